@@ -0,0 +1,190 @@
+""" Headless benchmarks for Origami's pane commands.
+
+Runs synthetic travel, create, destroy, zoom, resize and reorder workloads
+against the in-memory `sublime` stand-in in this directory, on windows with
+a growing number of panes, and reports the time and the number of editor
+(IPC) calls each operation costs.
+
+    python benchmarks/run.py
+    python benchmarks/run.py --sizes 1,50,500 --repeat 50 --workloads travel,destroy
+    python benchmarks/run.py --json > baseline.json
+"""
+from __future__ import division, print_function
+
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import re
+import sys
+import time
+import types
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+import sublime
+
+
+def load_origami():
+    """ Import origami.py the way Sublime Text does, as a module of the
+    'Origami' package, with the default package settings loaded. """
+    with open(os.path.join(ROOT, 'Origami.sublime-settings')) as settings_file:
+        text = settings_file.read()
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'^\s*//.*$', '', text, flags=re.M)
+    text = re.sub(r',(\s*[}\]])', r'\1', text)
+    sublime.load_settings('Origami.sublime-settings').data.update(json.loads(text))
+
+    package = types.ModuleType('Origami')
+    package.__path__ = [ROOT]
+    sys.modules['Origami'] = package
+
+    # Keep plugin messages (e.g. a missing MaxPane) out of the report
+    with contextlib.redirect_stdout(sys.stderr):
+        origami = importlib.import_module('Origami.origami')
+        origami.max_pane()
+    return origami
+
+
+def split_layout(geometry, panes):
+    """ The layout Origami builds by splitting panes breadth first, right
+    and down in turn, until there are `panes` groups. """
+    layout = geometry.Layout.make([0.0, 1.0], [0.0, 1.0], [[0, 0, 1, 1]])
+    queue = [(0, 0)]
+
+    while len(layout.cells) < panes:
+        group, depth = queue.pop(0)
+        layout = geometry.create_pane(layout, group, ('right', 'down')[depth % 2])
+        queue.extend([(group, depth + 1), (len(layout.cells) - 1, depth + 1)])
+    return layout.to_dict()
+
+
+def make_window(origami, panes, views_per_group):
+    window = sublime.Window()
+    window.reset(split_layout(origami.geometry, panes))
+
+    for group in range(panes):
+        for index in range(views_per_group):
+            window._groups[group].append(
+                sublime.View(window, '/bench/%s/file%s.py' % (group, index), size=100))
+    return window
+
+
+def travel(window, step):
+    direction = ('right', 'down', 'left', 'up')[step % 4]
+    window.run_command('travel_to_pane', {'direction': direction, 'create_new_if_necessary': False})
+
+
+def create(window, step):
+    window.run_command('create_pane', {'direction': ('right', 'down')[step % 2]})
+
+
+def destroy(window, step):
+    window.run_command('destroy_pane', {'direction': 'self'})
+
+
+def zoom(window, step):
+    window.run_command('zoom_pane', {'fraction': 0.8})
+    window.run_command('unzoom_pane')
+
+
+def resize(window, step):
+    window.run_command('resize_pane', {'orientation': 'cols', 'mode': 'NEAREST'})
+    _, text, on_done, on_change, _ = window.input_panel
+
+    values = [float(v) for v in text.split(',') if v.strip()]
+    typed = ', '.join('%.3f' % max(0.0, v - 0.01) for v in values)
+    for end in range(1, len(typed) + 1):
+        on_change(typed[:end])
+    sublime.run_timeouts()
+    on_done(typed)
+
+
+def reorder(window, step):
+    window.run_command('reorder_pane')
+    _, _, on_done, _, _ = window.input_panel
+    on_done(str(window.num_groups()))
+
+
+WORKLOADS = [
+    ('travel', travel),
+    ('create', create),
+    ('destroy', destroy),
+    ('zoom', zoom),
+    ('resize', resize),
+    ('reorder', reorder),
+]
+
+
+def run_workload(origami, function, panes, repeat, views_per_group):
+    elapsed = []
+    calls = {}
+
+    for step in range(repeat):
+        window = make_window(origami, panes, views_per_group)
+        window.focus_group((step * 7) % panes)
+        sublime.reset_counts()
+
+        start = time.perf_counter()
+        function(window, step)
+        sublime.run_timeouts()
+        elapsed.append(time.perf_counter() - start)
+
+        for name, count in sublime.calls.items():
+            calls[name] = calls.get(name, 0) + count
+
+    elapsed.sort()
+    return {
+        'mean_ms': 1000 * sum(elapsed) / repeat,
+        'p95_ms': 1000 * elapsed[min(repeat - 1, int(repeat * 0.95))],
+        'ipc': sum(calls.values()) / repeat,
+        'layout': calls.get('layout', 0) / repeat,
+        'set_layout': calls.get('set_layout', 0) / repeat,
+        'calls': dict((name, count / repeat) for name, count in calls.items()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='1,10,50,100,500',
+                        help='comma separated pane counts (default: %(default)s)')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='runs of each workload per size (default: %(default)s)')
+    parser.add_argument('--views', type=int, default=2,
+                        help='views opened in every group (default: %(default)s)')
+    parser.add_argument('--workloads', default=','.join(name for name, _ in WORKLOADS),
+                        help='comma separated workloads (default: %(default)s)')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args(argv)
+
+    origami = load_origami()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    selected = args.workloads.split(',')
+    results = []
+
+    for name, function in WORKLOADS:
+        if name not in selected:
+            continue
+        for panes in sizes:
+            result = run_workload(origami, function, panes, args.repeat, args.views)
+            result.update(workload=name, panes=panes)
+            results.append(result)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+
+    header = '%-10s %6s %10s %10s %8s %8s %11s' % (
+        'workload', 'panes', 'mean ms', 'p95 ms', 'IPC/op', 'layout', 'set_layout')
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print('%-10s %6d %10.3f %10.3f %8.1f %8.1f %11.1f' % (
+            r['workload'], r['panes'], r['mean_ms'], r['p95_ms'], r['ipc'], r['layout'], r['set_layout']))
+
+
+if __name__ == '__main__':
+    main()
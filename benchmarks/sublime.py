@@ -0,0 +1,433 @@
+""" In-memory stand-in for the parts of the `sublime` module Origami uses.
+
+Windows keep their layout, groups, views and settings in plain Python
+objects. Every call that would cross the plugin host boundary in the editor
+is counted in `calls`, keyed by method name, so benchmarks can report IPC
+traffic next to timings. Callbacks given to `set_timeout` are queued and run
+by `run_timeouts()`.
+"""
+import itertools
+
+TRANSIENT = 4
+FORCE_GROUP = 8
+
+calls = {}
+
+_ids = itertools.count(1)
+_timeouts = []
+_windows = []
+_settings = {}
+_active_window = None
+
+
+def count(name):
+    calls[name] = calls.get(name, 0) + 1
+
+
+def reset_counts():
+    calls.clear()
+
+
+def version():
+    return '3211'
+
+
+def platform():
+    return 'linux'
+
+
+def packages_path():
+    return ''
+
+
+def set_timeout(callback, delay=0):
+    _timeouts.append(callback)
+
+
+def set_timeout_async(callback, delay=0):
+    _timeouts.append(callback)
+
+
+def run_timeouts():
+    """ Run queued `set_timeout` callbacks, including the ones they queue. """
+    while _timeouts:
+        _timeouts.pop(0)()
+
+
+def load_settings(name):
+    if name not in _settings:
+        _settings[name] = Settings()
+    return _settings[name]
+
+
+def save_settings(name):
+    count('save_settings')
+
+
+def ok_cancel_dialog(message, ok_title=''):
+    return True
+
+
+def status_message(message):
+    count('status_message')
+
+
+def active_window():
+    global _active_window
+    if _active_window is None:
+        _active_window = Window()
+    return _active_window
+
+
+def windows():
+    return list(_windows)
+
+
+class Region(object):
+
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def __eq__(self, other):
+        return (self.a, self.b) == (other.a, other.b)
+
+    def __repr__(self):
+        return 'Region(%r, %r)' % (self.a, self.b)
+
+
+class Settings(object):
+
+    def __init__(self, data=None):
+        self.data = dict(data or {})
+        self.listeners = {}
+
+    def get(self, key, default=None):
+        count('settings.get')
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        count('settings.set')
+        self.data[key] = value
+        for callback in list(self.listeners.values()):
+            callback()
+
+    def has(self, key):
+        count('settings.has')
+        return key in self.data
+
+    def erase(self, key):
+        count('settings.erase')
+        self.data.pop(key, None)
+
+    def add_on_change(self, tag, callback):
+        self.listeners[tag] = callback
+
+    def clear_on_change(self, tag):
+        self.listeners.pop(tag, None)
+
+
+class Selection(list):
+
+    def clear(self):
+        count('sel.clear')
+        del self[:]
+
+    def add(self, region):
+        count('sel.add')
+        self.append(region)
+
+    def add_all(self, regions):
+        count('sel.add_all')
+        self.extend(regions)
+
+
+class View(object):
+
+    def __init__(self, window, file_name=None, name='', size=0, buffer_id=None):
+        self._id = next(_ids)
+        self._window = window
+        self._file_name = file_name
+        self._name = name
+        self._size = size
+        self._buffer_id = buffer_id or next(_ids)
+        self._sel = Selection([Region(0)])
+        self._settings = Settings()
+        self._viewport = (0.0, 0.0)
+        self._folds = []
+
+    def id(self):
+        return self._id
+
+    def buffer_id(self):
+        count('view.buffer_id')
+        return self._buffer_id
+
+    def window(self):
+        count('view.window')
+        return self._window
+
+    def file_name(self):
+        count('view.file_name')
+        return self._file_name
+
+    def name(self):
+        count('view.name')
+        return self._name
+
+    def size(self):
+        count('view.size')
+        return self._size
+
+    def is_dirty(self):
+        return False
+
+    def is_loading(self):
+        return False
+
+    def settings(self):
+        return self._settings
+
+    def sel(self):
+        return self._sel
+
+    def viewport_position(self):
+        count('view.viewport_position')
+        return self._viewport
+
+    def set_viewport_position(self, position, animate=True):
+        count('view.set_viewport_position')
+        self._viewport = position
+
+    def folded_regions(self):
+        count('view.folded_regions')
+        return list(self._folds)
+
+    def fold(self, regions):
+        count('view.fold')
+        self._folds.extend(regions)
+
+    def close(self):
+        count('view.close')
+        self._window._remove(self)
+        return True
+
+    def __repr__(self):
+        return 'View(%s)' % (self._file_name or self._id)
+
+
+class OutputPanel(View):
+    """ A view collecting the text appended to it. """
+
+    def __init__(self, window):
+        View.__init__(self, window)
+        self.text = ''
+
+    def run_command(self, name, args=None):
+        count('run_command')
+        if name == 'append':
+            self.text += args['characters']
+
+
+class Window(object):
+
+    def __init__(self):
+        self._id = next(_ids)
+        self._groups = [[]]
+        self._cols = [0.0, 1.0]
+        self._rows = [0.0, 1.0]
+        self._cells = [[0, 0, 1, 1]]
+        self._active_group = 0
+        self._active_views = {}
+        self._settings = Settings()
+        self.input_panel = None
+        self.quick_panel = None
+        self.output_panels = {}
+        _windows.append(self)
+
+    def reset(self, layout, active_group=0):
+        """ Replace the layout without counting any call; views of groups
+        that no longer exist go to the last group, like Sublime Text does. """
+        self._apply_layout(layout)
+        self._active_group = active_group
+
+    def _apply_layout(self, layout):
+        self._cols = list(layout['cols'])
+        self._rows = list(layout['rows'])
+        self._cells = [list(c) for c in layout['cells']]
+
+        num_groups = len(self._cells)
+        while len(self._groups) < num_groups:
+            self._groups.append([])
+        while len(self._groups) > num_groups:
+            self._groups[num_groups-1].extend(self._groups.pop())
+        self._active_group = min(self._active_group, num_groups-1)
+
+    def _remove(self, view):
+        for group, views in enumerate(self._groups):
+            if view in views:
+                views.remove(view)
+                if self._active_views.get(group) is view:
+                    del self._active_views[group]
+                return
+
+    def id(self):
+        return self._id
+
+    def settings(self):
+        count('window.settings')
+        return self._settings
+
+    def layout(self):
+        count('layout')
+        return {
+            'cols': list(self._cols),
+            'rows': list(self._rows),
+            'cells': [list(c) for c in self._cells],
+        }
+
+    def num_groups(self):
+        count('num_groups')
+        return len(self._groups)
+
+    def active_group(self):
+        count('active_group')
+        return self._active_group
+
+    def focus_group(self, group):
+        count('focus_group')
+        if 0 <= group < len(self._groups):
+            self._active_group = group
+
+    def views(self):
+        count('views')
+        return [v for views in self._groups for v in views]
+
+    def views_in_group(self, group):
+        count('views_in_group')
+        if 0 <= group < len(self._groups):
+            return list(self._groups[group])
+        return []
+
+    def active_view_in_group(self, group):
+        count('active_view_in_group')
+        views = self._groups[group] if 0 <= group < len(self._groups) else []
+        view = self._active_views.get(group)
+        if view in views:
+            return view
+        return views[0] if views else None
+
+    def active_view(self):
+        count('active_view')
+        views = self._groups[self._active_group]
+        view = self._active_views.get(self._active_group)
+        if view in views:
+            return view
+        return views[0] if views else None
+
+    def get_view_index(self, view):
+        count('get_view_index')
+        for group, views in enumerate(self._groups):
+            if view in views:
+                return group, views.index(view)
+        return -1, -1
+
+    def set_view_index(self, view, group, index):
+        count('set_view_index')
+        self._remove(view)
+        self._groups[group].insert(index, view)
+        self._active_views[group] = view
+
+    def focus_view(self, view):
+        count('focus_view')
+        for group, views in enumerate(self._groups):
+            if view in views:
+                self._active_group = group
+                self._active_views[group] = view
+                import sublime_plugin
+                sublime_plugin.emit('on_activated', view)
+                return
+
+    def new_file(self):
+        count('new_file')
+        view = View(self)
+        self._groups[self._active_group].append(view)
+        self._active_views[self._active_group] = view
+        return view
+
+    def open_file(self, file_name, flags=0, group=-1):
+        count('open_file')
+        for view in [v for views in self._groups for v in views]:
+            if view._file_name == file_name:
+                return view
+
+        if group < 0:
+            group = self._active_group
+        view = View(self, file_name, size=100)
+        self._groups[group].append(view)
+        self._active_views[group] = view
+        return view
+
+    def find_open_file(self, file_name):
+        count('find_open_file')
+        for view in [v for views in self._groups for v in views]:
+            if view._file_name == file_name:
+                return view
+        return None
+
+    def create_output_panel(self, name):
+        count('create_output_panel')
+        panel = self.output_panels[name] = OutputPanel(self)
+        return panel
+
+    def show_input_panel(self, caption, initial_text, on_done, on_change, on_cancel):
+        count('show_input_panel')
+        self.input_panel = (caption, initial_text, on_done, on_change, on_cancel)
+        return View(self)
+
+    def show_quick_panel(self, items, on_done, *args, **kwargs):
+        count('show_quick_panel')
+        self.quick_panel = (items, on_done)
+
+    def run_command(self, name, args=None):
+        count('run_command')
+        args = args or {}
+        import sublime_plugin
+
+        if name == 'set_layout':
+            count('set_layout')
+            self._apply_layout(args)
+
+        elif name == 'close':
+            view = self.active_view()
+            if view:
+                self._remove(view)
+
+        elif name == 'clone_file':
+            view = self.active_view()
+            clone = View(self, view._file_name, view._name, view._size, view._buffer_id)
+            self._groups[self._active_group].append(clone)
+            self._active_views[self._active_group] = clone
+
+        elif name == 'move_to_group':
+            view = self.active_view()
+            if view:
+                self.set_view_index(view, args['group'], len(self._groups[args['group']]))
+
+        elif name == 'focus_group':
+            self.focus_group(args['group'])
+
+        elif name == 'new_window':
+            global _active_window
+            _active_window = Window()
+
+        else:
+            sublime_plugin.run_window_command(self, name, args)
+
+        sublime_plugin.emit('on_post_window_command', self, name, args)
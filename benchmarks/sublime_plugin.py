@@ -0,0 +1,64 @@
+""" In-memory stand-in for the `sublime_plugin` module.
+
+Command classes register themselves under the snake_case name Sublime Text
+derives from the class name, event listeners are instantiated once, and
+`emit()` forwards events to every listener that implements them.
+"""
+import re
+
+_commands = {}
+_listener_classes = []
+_listeners = []
+
+
+def command_name(class_name):
+    name = class_name[:-len('Command')] if class_name.endswith('Command') else class_name
+    return re.sub(r'(?<!^)(?=[A-Z])', '_', name).lower()
+
+
+class _Registry(type):
+
+    def __init__(cls, name, bases, namespace):
+        type.__init__(cls, name, bases, namespace)
+
+        if getattr(cls, '_plugin_base', None) == 'command' and 'run' in namespace:
+            _commands[command_name(name)] = cls
+
+        elif getattr(cls, '_plugin_base', None) == 'listener' and '_plugin_base' not in namespace:
+            _listener_classes.append(cls)
+
+
+Plugin = _Registry('Plugin', (object,), {})
+
+
+class WindowCommand(Plugin):
+    _plugin_base = 'command'
+
+    def __init__(self, window):
+        self.window = window
+
+    def run_(self, edit_token, args):
+        return self.run(**(args or {}))
+
+
+class EventListener(Plugin):
+    _plugin_base = 'listener'
+
+
+def listeners():
+    while len(_listeners) < len(_listener_classes):
+        _listeners.append(_listener_classes[len(_listeners)]())
+    return _listeners
+
+
+def emit(event, *args):
+    for listener in listeners():
+        callback = getattr(listener, event, None)
+        if callback:
+            callback(*args)
+
+
+def run_window_command(window, name, args):
+    cls = _commands.get(name)
+    if cls is not None:
+        cls(window).run_(0, args)
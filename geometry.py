@@ -0,0 +1,643 @@
+""" Layout geometry for Origami.
+
+Everything in here works on plain values and never touches the `sublime`
+module, so layouts can be computed, compared and benchmarked without an
+editor window. Commands in origami.py read the window layout once, call into
+this module and hand the result to `set_layout`.
+"""
+from __future__ import division
+from collections import namedtuple
+
+XMIN, YMIN, XMAX, YMAX = list(range(4))
+
+
+class Layout(namedtuple('Layout', 'cols rows cells')):
+    """ An immutable window layout: `cols` and `rows` are tuples of grid line
+    positions between 0.0 and 1.0, `cells` a tuple of (x0, y0, x1, y1) grid
+    line indexes, one per group. """
+    __slots__ = ()
+
+    @classmethod
+    def make(cls, cols, rows, cells):
+        return cls(tuple(cols), tuple(rows), tuple(tuple(c) for c in cells))
+
+    @classmethod
+    def from_dict(cls, layout):
+        return cls.make(layout['cols'], layout['rows'], layout['cells'])
+
+    def to_dict(self):
+        """ The mutable form understood by `window.run_command('set_layout')`. """
+        return {
+            'cols': list(self.cols),
+            'rows': list(self.rows),
+            'cells': [list(c) for c in self.cells],
+        }
+
+
+def increment_if_greater_or_equal(x, threshold):
+    if x >= threshold:
+        return x+1
+    return x
+
+
+def decrement_if_greater(x, threshold):
+    if x > threshold:
+        return x-1
+    return x
+
+
+def pull_up_cells_after(cells, threshold):
+    return [    [x0,decrement_if_greater(y0, threshold),
+                x1,decrement_if_greater(y1, threshold)] for (x0,y0,x1,y1) in cells]
+
+
+def push_right_cells_after(cells, threshold):
+    return [    [increment_if_greater_or_equal(x0, threshold),y0,
+                increment_if_greater_or_equal(x1, threshold),y1] for (x0,y0,x1,y1) in cells]
+
+
+def push_down_cells_after(cells, threshold):
+    return [    [x0,increment_if_greater_or_equal(y0, threshold),
+                x1,increment_if_greater_or_equal(y1, threshold)] for (x0,y0,x1,y1) in cells]
+
+
+def pull_left_cells_after(cells, threshold):
+    return [    [decrement_if_greater(x0, threshold),y0,
+                decrement_if_greater(x1, threshold),y1] for (x0,y0,x1,y1) in cells]
+
+
+def opposite_direction(direction):
+    opposites = {'up':'down', 'right':'left', 'down':'up', 'left':'right'}
+    return opposites[direction]
+
+
+def cells_adjacent_to_cell_in_direction(cells, cell, direction):
+    fn = None
+    if direction == 'up':
+        fn = lambda orig, check: orig[YMIN] == check[YMAX]
+    elif direction == 'right':
+        fn = lambda orig, check: orig[XMAX] == check[XMIN]
+    elif direction == 'down':
+        fn = lambda orig, check: orig[YMAX] == check[YMIN]
+    elif direction == 'left':
+        fn = lambda orig, check: orig[XMIN] == check[XMAX]
+
+    if fn:
+        return [c for c in cells if fn(cell, c)]
+    return None
+
+
+class AdjacencyIndex(object):
+    """ Neighbour tables for one layout: for every group and direction, the
+    groups across that edge together with how much of the edge they share.
+
+    Everything is resolved on the integer grid coordinates of the cells, so
+    neighbours are found by exact comparisons: the cells on both sides of a
+    grid line are sorted along it once and swept together, pairing the ones
+    whose spans overlap. """
+
+    # direction: (edge of the current cell, matching edge of the neighbour, span axis)
+    DIRECTIONS = {
+        'up':    (YMIN, YMAX, 'cols'),
+        'right': (XMAX, XMIN, 'rows'),
+        'down':  (YMAX, YMIN, 'cols'),
+        'left':  (XMIN, XMAX, 'rows'),
+    }
+
+    def __init__(self, layout):
+        self.cells = layout.cells
+
+        # edge value -> groups, one table per cell side
+        edges = {}
+        for side in (XMIN, YMIN, XMAX, YMAX):
+            table = {}
+            for group, cell in enumerate(self.cells):
+                table.setdefault(cell[side], []).append(group)
+            edges[side] = table
+
+        # groups on the grid line of an edge, whether they share some of it or not
+        self.line_neighbours = {}
+        self.neighbours = {}
+        for direction, (own_side, other_side, axis) in self.DIRECTIONS.items():
+            if axis == 'cols':
+                MIN, MAX, fields = XMIN, XMAX, layout.cols
+            else:
+                MIN, MAX, fields = YMIN, YMAX, layout.rows
+
+            on_line = [edges[other_side].get(cell[own_side], []) for cell in self.cells]
+            per_group = [[] for _ in self.cells]
+
+            for line, own_groups in edges[own_side].items():
+                others = sorted(edges[other_side].get(line, ()), key=lambda g: self.cells[g][MIN])
+                if not others:
+                    continue
+
+                # cells on one side of a line never overlap each other, so
+                # both lists are runs of disjoint spans
+                i = 0
+                for group in sorted(own_groups, key=lambda g: self.cells[g][MIN]):
+                    cell = self.cells[group]
+                    while i < len(others) and self.cells[others[i]][MAX] <= cell[MIN]:
+                        i += 1
+                    j = i
+                    while j < len(others) and self.cells[others[j]][MIN] < cell[MAX]:
+                        other_cell = self.cells[others[j]]
+                        start = max(other_cell[MIN], cell[MIN])
+                        end = min(other_cell[MAX], cell[MAX])
+                        per_group[group].append((others[j], round(fields[end] - fields[start], 9)))
+                        j += 1
+
+            self.line_neighbours[direction] = on_line
+            self.neighbours[direction] = per_group
+
+    def adjacent_groups(self, group, direction):
+        """ The groups sharing part of the edge of `group`, along that edge. """
+        return [other for other, _ in self.neighbours[direction][group]]
+
+    def adjacent_group(self, group, direction, preferred=None):
+        """ The neighbour sharing the longest stretch of edge, or None.
+        `preferred` (e.g. the group the focus came from) wins if it is a
+        neighbour at all; among equal stretches the first one along the edge
+        wins. """
+        best_group = None
+        best_overlap = None
+        for other, overlap in self.neighbours[direction][group]:
+            if other == preferred:
+                return other
+            if best_overlap is None or overlap > best_overlap:
+                best_group, best_overlap = other, overlap
+        return best_group
+
+
+_adjacency_cache = {}
+_ADJACENCY_CACHE_SIZE = 16
+
+
+def adjacency_index(layout):
+    """ Return the AdjacencyIndex for this layout, building it only the first
+    time a given layout is seen. """
+    index = _adjacency_cache.get(layout)
+
+    if index is None:
+        if len(_adjacency_cache) >= _ADJACENCY_CACHE_SIZE:
+            _adjacency_cache.clear()
+        index = _adjacency_cache[layout] = AdjacencyIndex(layout)
+    return index
+
+
+def _compact_lines(lines, cells, MIN, MAX, merge):
+    """ Map every line index to its index once unused lines are dropped and,
+    if `merge` is set, lines at the same position without a cell between them
+    are merged. Returns None when there is nothing to change. """
+    used = set([0, len(lines)-1])
+    spans = set()
+    for cell in cells:
+        used.add(cell[MIN])
+        used.add(cell[MAX])
+        spans.add((cell[MIN], cell[MAX]))
+
+    mapping = {}
+    kept = []
+    for index in sorted(used):
+        if kept:
+            previous = kept[-1]
+            if merge and lines[previous] == lines[index] and (previous, index) not in spans:
+                mapping[index] = mapping[previous]
+                continue
+        mapping[index] = len(kept)
+        kept.append(index)
+
+    if len(kept) == len(lines):
+        return None
+    return mapping, [lines[i] for i in kept]
+
+
+def compact(layout, merge=False):
+    """ Drop the grid lines no cell edge uses any more, renumbering the cells
+    to match. Returns `layout` itself when there is nothing to drop.
+
+    With `merge`, lines that end up at the same position and split nothing
+    are merged as well. That is only right for a layout meant to stay: a
+    zoomed or previewed layout puts lines on top of each other for a while,
+    and the layout it goes back to needs the same cells. """
+    cols = _compact_lines(layout.cols, layout.cells, XMIN, XMAX, merge)
+    rows = _compact_lines(layout.rows, layout.cells, YMIN, YMAX, merge)
+    if cols is None and rows is None:
+        return layout
+
+    col_map, new_cols = cols or (None, layout.cols)
+    row_map, new_rows = rows or (None, layout.rows)
+
+    cells = []
+    for x0, y0, x1, y1 in layout.cells:
+        if col_map:
+            x0, x1 = col_map[x0], col_map[x1]
+        if row_map:
+            y0, y1 = row_map[y0], row_map[y1]
+        cells.append((x0, y0, x1, y1))
+    return Layout(tuple(new_cols), tuple(new_rows), tuple(cells))
+
+
+def from_rectangles(rectangles):
+    """ Build a Layout from one (x0, y0, x1, y1) rectangle per group, in
+    window fractions between 0.0 and 1.0. """
+    def lines(values):
+        # round so that edges computed along different paths still meet
+        return sorted(set(round(v, 9) for v in values))
+
+    cols = lines([r[XMIN] for r in rectangles] + [r[XMAX] for r in rectangles])
+    rows = lines([r[YMIN] for r in rectangles] + [r[YMAX] for r in rectangles])
+    col_index = dict((v, i) for i, v in enumerate(cols))
+    row_index = dict((v, i) for i, v in enumerate(rows))
+
+    cells = []
+    for x0, y0, x1, y1 in rectangles:
+        cells.append((col_index[round(x0, 9)], row_index[round(y0, 9)],
+                      col_index[round(x1, 9)], row_index[round(y1, 9)]))
+    return Layout(tuple(cols), tuple(rows), tuple(cells))
+
+
+def grid(num_rows, num_cols):
+    """ `num_rows` x `num_cols` equally sized panes, numbered row by row. """
+    return from_rectangles([
+        (col / num_cols, row / num_rows, (col+1) / num_cols, (row+1) / num_rows)
+        for row in range(num_rows) for col in range(num_cols)])
+
+
+def _columns_first(panes):
+    # near square: as many columns as rows, the first columns take the extra panes
+    num_cols = 1
+    while num_cols * num_cols < panes:
+        num_cols += 1
+    num_cols = min(num_cols, panes)
+
+    rectangles = []
+    for col in range(num_cols):
+        count = panes // num_cols + (1 if col < panes % num_cols else 0)
+        for row in range(count):
+            rectangles.append((col / num_cols, row / count, (col+1) / num_cols, (row+1) / count))
+    return rectangles
+
+
+def _balanced_bsp(panes):
+    # halve the space again and again, alternating the direction, giving each
+    # half an area proportional to the panes it holds
+    def split(rectangle, count, vertical):
+        if count == 1:
+            return [rectangle]
+
+        x0, y0, x1, y1 = rectangle
+        first = (count + 1) // 2
+        ratio = first / count
+        if vertical:
+            middle = x0 + (x1 - x0) * ratio
+            halves = (x0, y0, middle, y1), (middle, y0, x1, y1)
+        else:
+            middle = y0 + (y1 - y0) * ratio
+            halves = (x0, y0, x1, middle), (x0, middle, x1, y1)
+        return split(halves[0], first, not vertical) + split(halves[1], count - first, not vertical)
+
+    return split((0.0, 0.0, 1.0, 1.0), panes, True)
+
+
+def _golden_ratio(panes):
+    # every pane takes 1/phi of the space left, spiralling right and down
+    ratio = 2 / (1 + 5 ** 0.5)
+    rectangles = []
+    x0, y0, x1, y1 = 0.0, 0.0, 1.0, 1.0
+
+    for index in range(panes - 1):
+        if index % 2 == 0:
+            middle = x0 + (x1 - x0) * ratio
+            rectangles.append((x0, y0, middle, y1))
+            x0 = middle
+        else:
+            middle = y0 + (y1 - y0) * ratio
+            rectangles.append((x0, y0, x1, middle))
+            y0 = middle
+    rectangles.append((x0, y0, x1, y1))
+    return rectangles
+
+
+TILING_STRATEGIES = {
+    'columns': _columns_first,
+    'bsp': _balanced_bsp,
+    'golden': _golden_ratio,
+}
+
+
+def tile(panes, strategy='columns'):
+    """ A layout of `panes` panes arranged by `strategy`: 'columns' (a near
+    square grid filled column by column), 'bsp' (balanced binary splits) or
+    'golden' (golden ratio spiral). """
+    if strategy not in TILING_STRATEGIES:
+        raise ValueError('Unknown tiling strategy %r, expected one of %s' % (
+                         strategy, ', '.join(sorted(TILING_STRATEGIES))))
+    return from_rectangles(TILING_STRATEGIES[strategy](max(1, panes)))
+
+
+def create_pane(layout, group, direction):
+    """ Split `group` in two. The half in `direction` becomes a new group,
+    appended after the existing ones, unless the split is up or left: then the
+    new half keeps the index of `group` and the old half is appended. """
+    rows, cols, cells = list(layout.rows), list(layout.cols), [list(c) for c in layout.cells]
+
+    old_cell = cells.pop(group)
+    new_cell = []
+
+    if direction in ('up', 'down'):
+        cells = push_down_cells_after(cells, old_cell[YMAX])
+        rows.insert(old_cell[YMAX], (rows[old_cell[YMIN]] + rows[old_cell[YMAX]]) / 2)
+        new_cell = [old_cell[XMIN], old_cell[YMAX], old_cell[XMAX], old_cell[YMAX]+1]
+        old_cell = [old_cell[XMIN], old_cell[YMIN], old_cell[XMAX], old_cell[YMAX]]
+
+    elif direction in ('right', 'left'):
+        cells = push_right_cells_after(cells, old_cell[XMAX])
+        cols.insert(old_cell[XMAX], (cols[old_cell[XMIN]] + cols[old_cell[XMAX]]) / 2)
+        new_cell = [old_cell[XMAX], old_cell[YMIN], old_cell[XMAX]+1, old_cell[YMAX]]
+        old_cell = [old_cell[XMIN], old_cell[YMIN], old_cell[XMAX], old_cell[YMAX]]
+
+    if not new_cell:
+        return None
+
+    if direction in ('left', 'up'):
+        focused_cell = new_cell
+        unfocused_cell = old_cell
+    else:
+        focused_cell = old_cell
+        unfocused_cell = new_cell
+    cells.insert(group, focused_cell)
+    cells.append(unfocused_cell)
+    return Layout.make(cols, rows, cells)
+
+
+def destroy_target_direction(layout, group):
+    """ Out of the four adjacent panes, one was split to create this pane.
+    Return the direction it lies in, or None. """
+    index = adjacency_index(layout)
+    current = layout.cells[group]
+
+    target_dir = None
+    for dir in ('up', 'right', 'down', 'left'):
+        other = index.adjacent_group(group, dir)
+        if other is None:
+            continue
+        c = layout.cells[other]
+        if dir in ['up', 'down']:
+            if c[XMIN] == current[XMIN] and c[XMAX] == current[XMAX]:
+                target_dir = dir
+        elif dir in ['left', 'right']:
+            if c[YMIN] == current[YMIN] and c[YMAX] == current[YMAX]:
+                target_dir = dir
+    return target_dir
+
+
+def destroy_pane(layout, group, direction):
+    """ Remove the single pane next to `group` in `direction`, growing its
+    neighbours over the freed space. Returns (new layout, removed group), or
+    None if there isn't exactly one pane on that side. """
+    # the whole grid line goes away with the pane, so it must be the only
+    # one on that line
+    adjacent_groups = adjacency_index(layout).line_neighbours[direction][group]
+    if len(adjacent_groups) != 1:
+        return None
+
+    group_to_remove = adjacent_groups[0]
+    rows, cols, cells = list(layout.rows), list(layout.cols), [list(c) for c in layout.cells]
+    cell_to_remove = cells.pop(group_to_remove)
+
+    if direction == 'up':
+        rows.pop(cell_to_remove[YMAX])
+        for cell in cells_adjacent_to_cell_in_direction(cells, cell_to_remove, 'down'):
+            cell[YMIN] = cell_to_remove[YMIN]
+        cells = pull_up_cells_after(cells, cell_to_remove[YMAX])
+    elif direction == 'right':
+        cols.pop(cell_to_remove[XMIN])
+        for cell in cells_adjacent_to_cell_in_direction(cells, cell_to_remove, 'left'):
+            cell[XMAX] = cell_to_remove[XMAX]
+        cells = pull_left_cells_after(cells, cell_to_remove[XMIN])
+    elif direction == 'down':
+        rows.pop(cell_to_remove[YMIN])
+        for cell in cells_adjacent_to_cell_in_direction(cells, cell_to_remove, 'up'):
+            cell[YMAX] = cell_to_remove[YMAX]
+        cells = pull_up_cells_after(cells, cell_to_remove[YMIN])
+    elif direction == 'left':
+        cols.pop(cell_to_remove[XMAX])
+        for cell in cells_adjacent_to_cell_in_direction(cells, cell_to_remove, 'right'):
+            cell[XMIN] = cell_to_remove[XMIN]
+        cells = pull_left_cells_after(cells, cell_to_remove[XMAX])
+
+    return Layout.make(cols, rows, cells), group_to_remove
+
+
+def zoom(layout, group, fraction):
+    """ Give the row and column of `group` `fraction` of the window and share
+    the rest evenly between the other rows and columns. """
+    fraction = min(1, max(0, fraction))
+    current_cell = layout.cells[group]
+
+    #TODO:  the sizes of the unzoomed panes are calculated incorrectly if the
+    #       unzoomed panes have a split that overlaps the zoomed pane.
+    def spread(lines, current):
+        count = len(lines)-1
+        current_width = 1 if count==1 else fraction
+        other_width = 0 if count==1 else (1-current_width)/(count-1)
+
+        result = [0.0]
+        for i in range(0,count):
+            result.append(result[i] + (current_width if i == current else other_width))
+        return result
+
+    cols = spread(layout.cols, current_cell[XMIN])
+    rows = spread(layout.rows, current_cell[YMIN])
+    return Layout(tuple(cols), tuple(rows), layout.cells)
+
+
+def unzoom(layout):
+    """ Space all rows and all columns evenly. """
+    def even(lines):
+        count = len(lines)-1
+        width = 1.0/count
+
+        result = [0.0]
+        for i in range(0,count):
+            result.append(result[i] + width)
+        return result
+
+    return Layout(tuple(even(layout.cols)), tuple(even(layout.rows)), layout.cells)
+
+
+def cell_rectangle(layout, group):
+    """ The (x0, y0, x1, y1) window fractions covered by `group`. """
+    cell = layout.cells[group]
+    return (layout.cols[cell[XMIN]], layout.rows[cell[YMIN]],
+            layout.cols[cell[XMAX]], layout.rows[cell[YMAX]])
+
+
+def overlap_area(first, second):
+    width = min(first[XMAX], second[XMAX]) - max(first[XMIN], second[XMIN])
+    height = min(first[YMAX], second[YMAX]) - max(first[YMIN], second[YMIN])
+    return width * height if width > 0 and height > 0 else 0
+
+
+def match_layout(old, new):
+    """ Renumber the cells of `new` so that the groups of `old` keep their
+    index in the new cell overlapping them most, matching the biggest
+    overlaps first, one new cell per old group.
+
+    Returns (layout, targets): `new` with its cells reordered, and for every
+    group of `old` the group of that layout its views belong to. Only the
+    groups whose target differs from their own index need their views moved.
+    """
+    old_rectangles = [cell_rectangle(old, group) for group in range(len(old.cells))]
+    new_rectangles = [cell_rectangle(new, group) for group in range(len(new.cells))]
+
+    overlaps = []
+    for old_group, old_rectangle in enumerate(old_rectangles):
+        for new_group, new_rectangle in enumerate(new_rectangles):
+            area = overlap_area(old_rectangle, new_rectangle)
+            if area > 0:
+                overlaps.append((-area, old_group != new_group, old_group, new_group))
+    overlaps.sort()
+
+    # cell of `new` -> group of `old` it takes over
+    matched_old = {}
+    matched_new = {}
+    for _, _, old_group, new_group in overlaps:
+        if old_group not in matched_new and new_group not in matched_old:
+            matched_new[old_group] = new_group
+            matched_old[new_group] = old_group
+
+    num_groups = len(new.cells)
+    order = [None] * num_groups
+    for new_group, old_group in matched_old.items():
+        if old_group < num_groups:
+            order[old_group] = new_group
+
+    placed = set(group for group in order if group is not None)
+    leftovers = iter(group for group in range(num_groups) if group not in placed)
+    for index in range(num_groups):
+        if order[index] is None:
+            order[index] = next(leftovers)
+
+    index_of = dict((new_group, index) for index, new_group in enumerate(order))
+    targets = []
+    for old_group, old_rectangle in enumerate(old_rectangles):
+        if old_group in matched_new:
+            targets.append(index_of[matched_new[old_group]])
+            continue
+
+        # More old groups than new cells: join the cell covering most of it
+        best = max(range(num_groups), key=lambda g: (overlap_area(old_rectangle, new_rectangles[g]), -g))
+        targets.append(index_of[best])
+
+    layout = Layout(new.cols, new.rows, tuple(new.cells[group] for group in order))
+    return layout, targets
+
+
+def share_structure(layout, previous):
+    """ `layout`, reusing the cols, rows and cells tuples of `previous` where
+    they are equal, so a history of similar layouts keeps one copy of each. """
+    if previous is None:
+        return layout
+    return Layout(previous.cols if layout.cols == previous.cols else layout.cols,
+                  previous.rows if layout.rows == previous.rows else layout.rows,
+                  previous.cells if layout.cells == previous.cells else layout.cells)
+
+
+def permute(layout, order):
+    """ `layout` with group `index` taking the cell of group `order[index]`. """
+    return Layout(layout.cols, layout.rows, tuple(layout.cells[group] for group in order))
+
+
+def reading_order(layout):
+    """ The groups of `layout` sorted top to bottom, then left to right. """
+    return sorted(range(len(layout.cells)),
+                  key=lambda group: (layout.cells[group][YMIN], layout.cells[group][XMIN]))
+
+
+def relevant_lines(layout, group, orientation, mode):
+    """ The grid lines of `orientation` ('cols' or 'rows') that `mode` offers
+    for resizing around `group`, without the fixed first and last lines. """
+    cells = layout.cells
+
+    if orientation == 'cols':
+        data = layout.cols
+        min1 = YMIN
+        max1 = YMAX
+        min2 = XMIN
+        max2 = XMAX
+
+    elif orientation == 'rows':
+        data = layout.rows
+        min1 = XMIN
+        max1 = XMAX
+        min2 = YMIN
+        max2 = YMAX
+
+    relevant_indx = set()
+    current_cell = cells[group]
+
+    if mode == 'BEFORE':
+        relevant_indx.update(set([current_cell[min2]]))
+
+    elif mode == 'AFTER':
+        relevant_indx.update(set([current_cell[max2]]))
+
+    elif mode == 'NEAREST':
+        relevant_indx.update(set([current_cell[min2], current_cell[max2]]))
+
+    elif mode == 'RELEVANT':
+        min_val1 = current_cell[min1]
+        max_val1 = current_cell[max1]
+        for c in cells:
+            min_val2 = c[min1]
+            max_val2 = c[max1]
+            if min_val1 >= max_val2 or min_val2 >= max_val1:
+                continue
+            relevant_indx.update(set([c[min2], c[max2]]))
+
+    elif mode == 'ALL':
+        relevant_indx.update(set(range(len(data))))
+
+    relevant_indx.difference_update(set([0, len(data)-1])) # dont show the first and last value (it's always 0 and 1)
+    return sorted(relevant_indx)
+
+
+def resize(layout, orientation, relevant_indx, values):
+    """ Move the grid lines at `relevant_indx` of `orientation` ('cols' or
+    'rows') to `values`. Lines may cross each other; cells are renumbered so
+    they keep the same neighbours. """
+    if any(d > 1.0 for d in values):
+        return layout
+
+    orig_data = layout.cols if orientation == 'cols' else layout.rows
+    cells = [list(c) for c in layout.cells]
+    data = list(orig_data)
+    for i, d in zip(relevant_indx, values):
+        data[i] = d
+
+    data = list(enumerate(data))
+    data = sorted(data, key=lambda x: x[1]) # sort such that you can swap grid lines
+    indxes, data = map(list, zip(*data)) # indexes are also sorted
+
+    revelant_cell_entries = []
+    if orientation == 'cols':
+        revelant_cell_entries = [XMIN,XMAX]
+    elif orientation == 'rows':
+        revelant_cell_entries = [YMIN,YMAX]
+
+    # change the cell boundaries according to the sorted indexes
+    transformations = dict((old, new) for new, old in enumerate(indxes) if new != old)
+    if transformations:
+        for cell in cells:
+            for j in revelant_cell_entries:
+                cell[j] = transformations.get(cell[j], cell[j])
+
+    cols, rows = layout.cols, layout.rows
+    if orientation == 'cols':
+        cols = data
+    elif orientation == 'rows':
+        rows = data
+
+    return Layout.make(cols, rows, cells)
@@ -1,98 +1,608 @@
 from __future__ import division
-import sublime, sublime_plugin
 import time
-import threading
-import copy
+_import_started = time.perf_counter()
+
+import sublime, sublime_plugin
+import os
+from collections import deque, namedtuple
 from functools import partial
 
-XMIN, YMIN, XMAX, YMAX = list(range(4))
+from . import geometry
+from .geometry import Layout, adjacency_index, opposite_direction
+from .profiling import profiler, profiled
 
-try:
-    # Do not import State directly to not break us in case the MaxPane.max_pane module is reloaded
-    import MaxPane
 
-except ImportError as error:
-    print('Origami Error: Could not import the MaxPane package!', error)
+class _MaxPaneStub(object):
+    """ Stands in for MaxPane when that package is not installed. """
 
-    class MaxPane(object):
+    class max_pane(object):
 
-        class max_pane(object):
+        class State(object):
+            is_fixing_layout = False
 
-            class State(object):
-                is_fixing_layout = False
 
+_max_pane = None
 
-def increment_if_greater_or_equal(x, threshold):
-    if x >= threshold:
-        return x+1
-    return x
 
+def max_pane():
+    """ The MaxPane package, imported the first time a layout is set rather
+    than when the plugin loads; a stub if it is not installed. """
+    global _max_pane
 
-def decrement_if_greater(x, threshold):
-    if x > threshold:
-        return x-1
-    return x
+    if _max_pane is None:
+        try:
+            # Do not import State directly to not break us in case the MaxPane.max_pane module is reloaded
+            import MaxPane
+            _max_pane = MaxPane
+
+        except ImportError as error:
+            print('Origami Error: Could not import the MaxPane package!', error)
+            _max_pane = _MaxPaneStub
 
+    return _max_pane
 
-def pull_up_cells_after(cells, threshold):
-    return [    [x0,decrement_if_greater(y0, threshold),
-                x1,decrement_if_greater(y1, threshold)] for (x0,y0,x1,y1) in cells]
 
+def views_in_group(window, group):
+    profiler.count('views_in_group')
+    return window.views_in_group(group)
 
-def push_right_cells_after(cells, threshold):
-    return [    [increment_if_greater_or_equal(x0, threshold),y0,
-                increment_if_greater_or_equal(x1, threshold),y1] for (x0,y0,x1,y1) in cells]
 
+def set_timeout(callback, delay=0):
+    profiler.count('set_timeout')
+    profiler.count('set_timeout_ms', delay)
+    sublime.set_timeout(callback, delay)
 
-def push_down_cells_after(cells, threshold):
-    return [    [x0,increment_if_greater_or_equal(y0, threshold),
-                x1,increment_if_greater_or_equal(y1, threshold)] for (x0,y0,x1,y1) in cells]
 
+class SuppressListeners(object):
+    """ Makes Origami's event listeners ignore the events fired while the
+    `with SuppressListeners():` block runs, e.g. the activations and closes
+    caused by Origami cleaning up views itself. """
+    depth = 0
 
-def pull_left_cells_after(cells, threshold):
-    return [    [decrement_if_greater(x0, threshold),y0,
-                decrement_if_greater(x1, threshold),y1] for (x0,y0,x1,y1) in cells]
+    def __enter__(self):
+        SuppressListeners.depth += 1
+        return self
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        SuppressListeners.depth -= 1
 
-def opposite_direction(direction):
-    opposites = {'up':'down', 'right':'left', 'down':'up', 'left':'right'}
-    return opposites[direction]
 
+def close_views(window, views):
+    """ Close `views` in one go. Views are closed directly where the API
+    allows it (Sublime Text 4); otherwise each one has to be focused to be
+    closed, and the focus is given back once at the end. """
+    active_view = None
 
-def cells_adjacent_to_cell_in_direction(cells, cell, direction):
-    fn = None
-    if direction == 'up':
-        fn = lambda orig, check: orig[YMIN] == check[YMAX]
-    elif direction == 'right':
-        fn = lambda orig, check: orig[XMAX] == check[XMIN]
-    elif direction == 'down':
-        fn = lambda orig, check: orig[YMAX] == check[YMIN]
-    elif direction == 'left':
-        fn = lambda orig, check: orig[XMIN] == check[XMAX]
+    with SuppressListeners():
+        for view in views:
+            if hasattr(view, 'close'):
+                view.close()
+                continue
 
-    if fn:
-        return [c for c in cells if fn(cell, c)]
-    return None
+            if active_view is None:
+                active_view = window.active_view()
+            window.focus_view(view)
+            window.run_command('close')
+
+        if active_view:
+            window.focus_view(active_view)
 
 
 def fixed_set_layout(window, layout):
+    transaction = LayoutTransaction.current(window)
+    if transaction:
+        transaction.set_layout(layout)
+        return
+    _set_layout(window, layout, history=not PauseLayoutHistory.depth)
+
+
+def _set_layout(window, layout, active_group=None, history=True, moved_views=(), previous_layout=None):
     #A bug was introduced in Sublime Text 3, sometime before 3053, in that it
     #changes the active group to 0 when the layout is changed. Annoying.
-    MaxPane.max_pane.State.is_fixing_layout = True
-    active_group = window.active_group()
+    layout = compacted_layout(layout)
+
+    State = max_pane().max_pane.State
+    State.is_fixing_layout = True
+    previous_group = window.active_group()
+    if active_group is None:
+        active_group = previous_group
+
+    # Setting the layout the window already has, moving no tab, is not a
+    # step worth undoing
+    if history and (moved_views or Layout.from_dict(layout) != LayoutSnapshots.fetch(window)):
+        if previous_layout is None:
+            previous_layout = LayoutHistory.unzoomed_layout(window)
+        LayoutHistory.record(window, previous_layout, previous_group,
+                             len(layout['cells']), moved_views)
+
     window.run_command('set_layout', layout)
+    profiler.count('set_layout')
+    LayoutSnapshots.invalidate(window)
 
     num_groups = len(layout['cells'])
     window.focus_group(min(active_group, num_groups-1))
-    MaxPane.max_pane.State.is_fixing_layout = False
+    State.is_fixing_layout = False
 
 
 def fixed_set_layout_no_focus_change(window, layout):
+    transaction = LayoutTransaction.current(window)
+    if transaction:
+        transaction.set_layout(layout)
+        return
+
+    layout = compacted_layout(layout)
     window.run_command('set_layout', layout)
+    profiler.count('set_layout')
+    LayoutSnapshots.invalidate(window)
+
+
+def compacted_layout(layout):
+    """ The `set_layout` arguments for `layout` (a Layout or a layout dict)
+    once the grid lines no pane uses any more are dropped. """
+    if not isinstance(layout, Layout):
+        layout = Layout.from_dict(layout)
+    return geometry.compact(layout).to_dict()
+
+
+class LayoutSnapshots(object):
+    """ Caches the layout of a window while an Origami command runs, so it is
+    fetched from the editor at most once per invocation unless Origami itself
+    sets a new layout in between. Use `with LayoutSnapshots(window):` to open
+    a scope; outside any scope every fetch goes to the window.
+
+    `fetches` counts the window.layout() calls made, `hits` the ones avoided.
+    """
+    _scopes = {}
+    fetches = 0
+    hits = 0
+
+    def __init__(self, window):
+        self.window = window
+
+    def __enter__(self):
+        scope = LayoutSnapshots._scopes.setdefault(self.window.id(), [0, None])
+        scope[0] += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        window_id = self.window.id()
+        scope = LayoutSnapshots._scopes[window_id]
+        scope[0] -= 1
+        if scope[0] == 0:
+            del LayoutSnapshots._scopes[window_id]
+
+    @classmethod
+    def fetch(cls, window):
+        scope = cls._scopes.get(window.id())
+        if scope is not None and scope[1] is not None:
+            cls.hits += 1
+            return scope[1]
+
+        cls.fetches += 1
+        profiler.count('layout')
+        layout = Layout.from_dict(window.layout())
+        if scope is not None:
+            scope[1] = layout
+        return layout
+
+    @classmethod
+    def invalidate(cls, window):
+        scope = cls._scopes.get(window.id())
+        if scope is not None:
+            scope[1] = None
+
+
+class LayoutTransaction(object):
+    """ Collects the layout changes, focus changes and view moves Origami makes
+    on one window and applies them with a single set_layout once the outermost
+    `with layout_transaction(window):` block exits.
+
+    While a transaction is open, `fixed_set_layout`, `get_active_group`,
+    `focus_group` and `move_view` work against the pending state, so code
+    running inside it (including other Origami commands started with
+    `window.run_command`) sees its own changes without touching the window.
+    """
+    _open = {}
+    total_commits_saved = 0
+
+    def __init__(self, window):
+        self.window = window
+        self.depth = 0
+        self.layout = None
+        self.active_group = None
+        # (view, group it leaves, group, index) in the order they were made
+        self.moves = []
+        self.set_layout_calls = 0
+        self.commits_saved = 0
+        # whether the layout history records the state this commit replaces
+        self.history = True
+        self.zoom_layout = None
+        # commands to run once the window shows the committed layout
+        self.after_commit = []
+
+    @classmethod
+    def current(cls, window):
+        return cls._open.get(window.id())
+
+    def __enter__(self):
+        if self.depth == 0:
+            LayoutTransaction._open[self.window.id()] = self
+            # What the layout history records if the commit changes the
+            # layout, taken before any unzooming in the transaction
+            self.zoom_layout = ZoomStates.get(self.window).layout
+        self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.depth -= 1
+        if self.depth == 0:
+            del LayoutTransaction._open[self.window.id()]
+            if exc_type is None:
+                self.commit()
+
+    def get_active_group(self):
+        if self.active_group is None:
+            return self.window.active_group()
+        return self.active_group
+
+    def set_layout(self, layout):
+        if not isinstance(layout, Layout):
+            layout = Layout.from_dict(layout)
+        self.active_group = min(self.get_active_group(), len(layout.cells)-1)
+        self.layout = layout
+        self.set_layout_calls += 1
+
+    def moved_views(self):
+        """ The (view, group) pairs of the views the moves take out of their
+        group on screen, a view moved several times counting once. """
+        seen = set()
+        moved = []
+        for view, from_group, _, _ in self.moves:
+            if view.id() not in seen:
+                seen.add(view.id())
+                moved.append((view, from_group))
+        return moved
+
+    def commit(self):
+        window = self.window
+        if self.layout is not None:
+            _set_layout(window, self.layout, self.get_active_group(), self.history,
+                        self.moved_views(), self.zoom_layout)
+        elif self.active_group is not None:
+            window.focus_group(self.active_group)
+
+        # Tabs changing panes activate them on the way, which is not a focus
+        # change the listeners should react to
+        with SuppressListeners():
+            for view, _, group, index in self.moves:
+                if index is None:
+                    index = len(views_in_group(window, group))
+                window.set_view_index(view, group, index)
+
+        self.commits_saved = max(0, self.set_layout_calls - 1)
+        LayoutTransaction.total_commits_saved += self.commits_saved
+
+        for callback in self.after_commit:
+            callback()
+
+
+def after_commit(window, callback):
+    """ Run `callback` once the transaction open on `window` has been
+    committed, or right away if there is none. For commands of other
+    packages, which only see the layout the window shows. """
+    transaction = LayoutTransaction.current(window)
+    if transaction:
+        transaction.after_commit.append(callback)
+    else:
+        callback()
+
+
+def layout_transaction(window):
+    """ Return the transaction open on `window`, or a new one, for use as a
+    context manager. """
+    return LayoutTransaction.current(window) or LayoutTransaction(window)
+
+
+def get_active_group(window):
+    transaction = LayoutTransaction.current(window)
+    if transaction:
+        return transaction.get_active_group()
+    return window.active_group()
+
+
+def focus_group(window, group):
+    transaction = LayoutTransaction.current(window)
+    if transaction:
+        transaction.active_group = group
+    else:
+        window.focus_group(group)
+
+
+def move_view(window, view, group, index=None, from_group=None):
+    """ Move `view` to position `index` of `group`, or after its last tab if
+    `index` is None. `from_group` is the group the view is in now, if the
+    caller knows it, which spares the layout history asking for it. """
+    transaction = LayoutTransaction.current(window)
+    if transaction:
+        transaction.moves.append((view, from_group, group, index))
+        return
+
+    if index is None:
+        index = len(views_in_group(window, group))
+    window.set_view_index(view, group, index)
+
+
+def _round_robin(views_by_group, num_groups):
+    # Deal the tabs out in their current order
+    position = 0
+    for group, views in enumerate(views_by_group):
+        for view in views:
+            yield view, group, position % num_groups
+            position += 1
+
+
+def _least_loaded(views_by_group, num_groups):
+    # Even out the number of tabs per pane, moving as few tabs as possible:
+    # every pane keeps its first tabs up to its share and only the rest moves
+    total = sum(len(views) for views in views_by_group)
+    counts = [len(views_by_group[group]) if group < len(views_by_group) else 0
+              for group in range(num_groups)]
+    fuller_first = sorted(range(num_groups), key=lambda group: -counts[group])
+
+    capacities = [total // num_groups] * num_groups
+    for group in fuller_first[:total % num_groups]:
+        capacities[group] += 1
+
+    loads = [0] * num_groups
+    excess = []
+    for group, views in enumerate(views_by_group):
+        for view in views:
+            if group < num_groups and loads[group] < capacities[group]:
+                loads[group] += 1
+                yield view, group, group
+            else:
+                excess.append((view, group))
+
+    target = 0
+    for view, group in excess:
+        while loads[target] >= capacities[target]:
+            target += 1
+        loads[target] += 1
+        yield view, group, target
+
+
+def _by_key(key):
+    # Keep tabs sharing a key together, biggest bunches first, each one in
+    # the pane holding the fewest tabs so far
+    def distribute(views_by_group, num_groups):
+        keys = []
+        bunches = {}
+        for group, views in enumerate(views_by_group):
+            for view in views:
+                bunch_key = key(view.file_name() or '')
+                if bunch_key not in bunches:
+                    keys.append(bunch_key)
+                    bunches[bunch_key] = []
+                bunches[bunch_key].append((view, group))
+
+        loads = [0] * num_groups
+        for bunch_key in sorted(keys, key=lambda k: -len(bunches[k])):
+            target = loads.index(min(loads))
+            loads[target] += len(bunches[bunch_key])
+            for view, group in bunches[bunch_key]:
+                yield view, group, target
+
+    return distribute
+
+
+DISTRIBUTION_STRATEGIES = {
+    'round_robin': _round_robin,
+    'least_loaded': _least_loaded,
+    'directory': _by_key(os.path.dirname),
+    'extension': _by_key(lambda file_name: os.path.splitext(file_name)[1].lower()),
+}
+
+
+def plan_view_distribution(views_by_group, num_groups, strategy='round_robin'):
+    """ Spread the views listed per pane in `views_by_group` over `num_groups`
+    panes. Returns the (view, from_group, group, index) moves needed, to be
+    applied in that order: every index puts the view after the tabs staying in
+    its new pane and the ones moved there before it. """
+    if strategy not in DISTRIBUTION_STRATEGIES:
+        raise ValueError('Unknown distribution strategy %r, expected one of %s' % (
+                         strategy, ', '.join(sorted(DISTRIBUTION_STRATEGIES))))
+
+    plan = list(DISTRIBUTION_STRATEGIES[strategy](views_by_group, max(1, num_groups)))
+
+    sizes = [0] * max(1, num_groups)
+    for view, group, target in plan:
+        if target == group:
+            sizes[target] += 1
+
+    moves = []
+    for view, group, target in plan:
+        if target != group:
+            moves.append((view, group, target, sizes[target]))
+            sizes[target] += 1
+    return moves
+
+
+class PauseLayoutHistory(object):
+    """ Layouts set while the `with PauseLayoutHistory():` block runs, outside
+    of a layout transaction, are not recorded in the layout history. """
+    depth = 0
+
+    def __enter__(self):
+        PauseLayoutHistory.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        PauseLayoutHistory.depth -= 1
+
+
+class LayoutState(namedtuple('LayoutState', 'layout active_group assignments')):
+    """ An entry of the layout history: the layout, the group that was active
+    and the (view, group) pairs of the views that the change took out of
+    their group, if any. Every other view keeps its group index. """
+
+
+class LayoutHistory(sublime_plugin.EventListener):
+    """ Undo and redo stacks of the layouts Origami replaced on each window.
+    The undo stack is a ring buffer of "layout_history_size" entries, and
+    consecutive layouts share their unchanged cols, rows and cells tuples. """
+    windows = {}
+
+    @classmethod
+    def stacks(cls, window):
+        size = max(1, SettingsSnapshot.get().layout_history_size)
+        stacks = cls.windows.get(window.id())
+        if stacks is None:
+            stacks = cls.windows[window.id()] = (deque(maxlen=size), [])
+        elif stacks[0].maxlen != size:
+            stacks = cls.windows[window.id()] = (deque(stacks[0], maxlen=size), stacks[1])
+        return stacks
+
+    @staticmethod
+    def capture(window, layout, active_group, num_groups, moved_views, previous=None):
+        """ The state of `window` before it changes to `num_groups` groups and
+        the views of the (view, group) pairs `moved_views` leave their group,
+        looked up for the pairs whose group is None. The views of the groups
+        about to go away get merged into the last one, so those are remembered
+        too. """
+        assignments = []
+        for group in range(num_groups, len(layout.cells)):
+            for view in views_in_group(window, group):
+                assignments.append((view, group))
+        for view, group in moved_views:
+            if group is None:
+                group = window.get_view_index(view)[0]
+            if group != -1:
+                assignments.append((view, group))
+
+        if previous is not None:
+            layout = geometry.share_structure(layout, previous.layout)
+        return LayoutState(layout, active_group, tuple(assignments) or None)
+
+    @staticmethod
+    def unzoomed_layout(window):
+        """ The layout to remember for `window`: while a pane is zoomed, the
+        one the zoom goes back to rather than the zoomed one on screen. """
+        zoom = ZoomStates.get(window)
+        if zoom.is_zoomed():
+            return zoom.layout
+        return LayoutSnapshots.fetch(window)
+
+    @classmethod
+    def record(cls, window, layout, active_group, num_groups, moved_views=()):
+        """ Remember the state a layout change is about to replace. """
+        if not SettingsSnapshot.get().layout_history_size:
+            return
+
+        undo, redo = cls.stacks(window)
+        previous = undo[-1] if undo else None
+        state = cls.capture(window, layout, active_group, num_groups, moved_views, previous)
+        if previous is None or previous != state:
+            undo.append(state)
+        del redo[:]
+
+    def on_pre_close_window(self, window):
+        self.windows.pop(window.id(), None)
+
+
+def current_layout(window):
+    """ The layout pending in the transaction open on `window`, or the one the
+    window shows. """
+    transaction = LayoutTransaction.current(window)
+    if transaction and transaction.layout is not None:
+        return transaction.layout
+    return LayoutSnapshots.fetch(window)
+
+
+def restore_layout(window, layout):
+    """ Switch `window` to `layout`, numbering its cells after the panes they
+    overlap most so that the views of those panes stay where they are. Only
+    the views of panes with no place left are moved, to the new pane that
+    covers most of their old one. """
+    if not isinstance(layout, Layout):
+        layout = Layout.from_dict(layout)
+
+    with layout_transaction(window):
+        old_layout = current_layout(window)
+        layout, targets = geometry.match_layout(old_layout, layout)
+        active_group = get_active_group(window)
+
+        views_by_group = [views_in_group(window, group) if targets[group] != group else ()
+                          for group in range(len(old_layout.cells))]
+        fixed_set_layout(window, layout)
+
+        for group, views in enumerate(views_by_group):
+            for view in views:
+                move_view(window, view, targets[group], from_group=group)
+        focus_group(window, targets[active_group])
+
+
+class ZoomState(object):
+    """ Zoom bookkeeping of one window: the layout to go back to, and the
+    fraction and group of Origami's zoom, if any. """
+
+    def __init__(self):
+        self.layout = None
+        self.fraction = None
+        self.group = None
+        self.max_pane_maximized = None
+        self.stale = False
+
+    def is_zoomed(self):
+        return self.layout is not None
+
+
+class ZoomStates(sublime_plugin.EventListener):
+    """ Keeps the zoom state of every window in memory, so checking it costs
+    no call into the editor. It is read from the window settings the first
+    time a window is seen, and again after a MaxPane command changed them.
+    Those settings are shared with MaxPane, so zooming and unzooming still
+    write them right away. """
+    states = {}
+
+    @classmethod
+    def get(cls, window):
+        state = cls.states.get(window.id())
+        if state is None or state.stale:
+            state = cls.states[window.id()] = cls.load(window)
+        return state
+
+    @staticmethod
+    def load(window):
+        settings = window.settings()
+        state = ZoomState()
+
+        layout = settings.get( 'original_panes_layout' )
+        if layout:
+            state.layout = Layout.from_dict(layout)
+            state.fraction = settings.get( 'origami_fraction' )
+            state.group = settings.get( 'maximized_pane_group' )
+
+        state.max_pane_maximized = settings.get( 'max_pane_maximized' )
+        return state
+
+    @classmethod
+    def invalidate(cls, window):
+        state = cls.states.get(window.id())
+        if state is not None:
+            state.stale = True
+
+    def on_post_window_command(self, window, command_name, args):
+        if 'maximize' in command_name or 'max_pane' in command_name:
+            # MaxPane changed the layout behind our back
+            LayoutSnapshots.invalidate(window)
+            self.invalidate(window)
+
+    def on_pre_close_window(self, window):
+        self.states.pop(window.id(), None)
 
 
 def is_pane_zoomed(window):
-    return window.settings().get( 'original_panes_layout' )
+    return ZoomStates.get(window).is_zoomed()
 
 
 def maximize_pane(window, fraction):
@@ -101,13 +611,14 @@ def maximize_pane(window, fraction):
         window.run_command( 'zoom_pane', { 'fraction': fraction } )
 
     else:
-        window.run_command( 'maximize_pane' )
+        # MaxPane saves the layout it finds on the window, so it has to run
+        # after any pending layout change has been applied
+        after_commit( window, lambda: window.run_command( 'maximize_pane' ) )
 
 
 def unmaximize_pane(window):
-    settings = window.settings()
 
-    if settings.get( 'origami_fraction' ):
+    if ZoomStates.get(window).fraction:
         window.run_command( 'unzoom_pane' )
 
     else:
@@ -115,30 +626,113 @@ def unmaximize_pane(window):
 
 
 def run_unzoomed(self, target_function):
-    has_zoom = self.has_zoom()
     window = self.window
 
-    if has_zoom:
-        settings = window.settings()
-        unmaximize_pane( window )
+    if not self.has_zoom():
+        target_function()
 
-        def try_create(attempt):
+    elif ZoomStates.get(window).fraction:
+        # Our own zoom can be undone right here, so the layout is already
+        # unzoomed when this returns.
+        self.unzoom_pane()
+        target_function()
 
-            if attempt < 0:
-                print( "Origami Error: Timed out to create the pane..." )
-                return
+    else:
+        # MaxPane maximized the pane: wait for its unmaximize_pane to finish.
+        RunWhenUnzoomed.queue( window, target_function )
+        window.run_command( 'unmaximize_pane' )
+        LayoutSnapshots.invalidate( window )
+        ZoomStates.invalidate( window )
 
-            has_zoom = self.has_zoom()
-            if has_zoom:
-                sublime.set_timeout( lambda: try_create( attempt - 1 ), 100 )
+        if not is_pane_zoomed( window ):
+            RunWhenUnzoomed.flush( window )
 
-            else:
-                target_function()
 
-        try_create( 15 )
+class RunWhenUnzoomed(sublime_plugin.EventListener):
+    """ Runs the pane operations `run_unzoomed` queued on a window as soon as the
+    command unzooming it has finished. """
+    pending = {}
 
-    else:
-        target_function()
+    @classmethod
+    def queue(cls, window, callback):
+        cls.pending.setdefault(window.id(), []).append(callback)
+
+    @classmethod
+    def flush(cls, window):
+        callbacks = cls.pending.pop(window.id(), None)
+        if not callbacks:
+            return
+
+        if is_pane_zoomed( window ):
+            print( "Origami Error: The pane is still zoomed, dropping %s pane operation(s)..." % len(callbacks) )
+            return
+
+        with layout_transaction(window):
+            for callback in callbacks:
+                callback()
+
+    def on_post_window_command(self, window, command_name, args):
+        if command_name in ('unzoom_pane', 'unmaximize_pane'):
+            # The queued operations must see the unzoomed layout, which this
+            # listener may get to before ZoomStates does
+            LayoutSnapshots.invalidate(window)
+            ZoomStates.invalidate(window)
+            self.flush(window)
+
+
+class ViewIndex(sublime_plugin.EventListener):
+    """ Remembers the buffer id and file name of the views Origami looked at,
+    so finding duplicated and tabless views again costs no call per view.
+    Each is asked for the first time it is needed, and forgotten when it can
+    change (a Save As renames the view) or when the view closes. Which pane a
+    view is in is not cached: Sublime Text sends no event when a tab is
+    dragged to another pane, so that is still asked with one views_in_group()
+    call per pane. """
+    buffer_ids = {}
+    file_names = {}
+
+    @classmethod
+    def buffer_id(cls, view):
+        buffer_id = cls.buffer_ids.get(view.id())
+        if buffer_id is None:
+            buffer_id = cls.buffer_ids[view.id()] = view.buffer_id()
+        return buffer_id
+
+    @classmethod
+    def file_name(cls, view):
+        try:
+            return cls.file_names[view.id()]
+        except KeyError:
+            file_name = cls.file_names[view.id()] = view.file_name()
+            return file_name
+
+    def on_post_save(self, view):
+        # Save As gives untitled views a file name
+        self.file_names.pop(view.id(), None)
+
+    def on_close(self, view):
+        self.buffer_ids.pop(view.id(), None)
+        self.file_names.pop(view.id(), None)
+
+
+class TravelHistory(sublime_plugin.EventListener):
+    """ Remembers the last pane Origami moved the focus away from, per window,
+    so that moving back picks that pane again among several neighbours. """
+    last = {}
+
+    @classmethod
+    def record(cls, window, layout, from_group, to_group):
+        cls.last[window.id()] = (layout, from_group, to_group)
+
+    @classmethod
+    def preferred(cls, window, layout, group):
+        last = cls.last.get(window.id())
+        if last and last[2] == group and last[0] == layout:
+            return last[1]
+        return None
+
+    def on_pre_close_window(self, window):
+        self.last.pop(window.id(), None)
 
 
 class WithSettings:
@@ -149,12 +743,252 @@ class WithSettings:
             self._settings = sublime.load_settings('Origami.sublime-settings')
         return self._settings
 
+    @staticmethod
+    def snapshot():
+        return SettingsSnapshot.get()
+
+
+class SettingsSnapshot(object):
+    """ Parsed copy of the package settings read on the hottest event paths.
+    It is refreshed from an `add_on_change` callback, so reading it costs no
+    call into the editor. A setting missing from the package settings is
+    None, letting the listeners fall back to the older per-view settings. """
+    _instance = None
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @classmethod
+    def release(cls):
+        if cls._instance is not None:
+            cls._instance.settings.clear_on_change('origami_snapshot')
+            cls._instance = None
+
+    def __init__(self):
+        self.settings = sublime.load_settings('Origami.sublime-settings')
+        self.settings.add_on_change('origami_snapshot', self.refresh)
+        self.refresh()
+
+    def refresh(self):
+        settings = self.settings
+        self.auto_zoom_on_focus = settings.get('auto_zoom_on_focus')
+        self.auto_close_empty_panes = settings.get('auto_close_empty_panes')
+        self.auto_zoom_on_focus_delay = settings.get('auto_zoom_on_focus_delay', 50)
+        self.layout_history_size = settings.get('layout_history_size', 50)
+        self.profiling = bool(settings.get('profiling', False))
+        profiler.enabled = self.profiling
+
+
+class SavedLayouts(WithSettings):
+    """ The layouts saved with save_layout, kept in memory with a nickname
+    index. Changes are written back to their own settings file from the
+    async thread, and a burst of changes is written only once. """
+    SETTINGS_FILE = 'Origami Layouts.sublime-settings'
+    _instance = None
+
+    @classmethod
+    def get(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        self.store = sublime.load_settings(self.SETTINGS_FILE)
+        self.save_scheduled = False
+        self.load()
+
+        if self.store.get('saved_layouts') is None:
+            # Move the layouts saved by older versions into the store
+            legacy = self.settings().get('saved_layouts') or []
+            if legacy:
+                self.layouts = [dict(l) for l in legacy]
+                self.changed()
+
+        self.store.add_on_change('origami_saved_layouts', self.on_store_change)
+
+    @classmethod
+    def release(cls):
+        if cls._instance is not None:
+            cls._instance.store.clear_on_change('origami_saved_layouts')
+            cls._instance = None
+
+    def load(self):
+        self.layouts = [dict(l) for l in self.store.get('saved_layouts') or []]
+        self.written = self.store.get('saved_layouts')
+        self.reindex()
+
+    def reindex(self):
+        self.index = dict((l['nickname'], i) for i, l in enumerate(self.layouts))
+        self._names = None
+
+    def on_store_change(self):
+        # Edited by hand: pick up the new list unless it is the one we wrote
+        if not self.save_scheduled and self.store.get('saved_layouts') != self.written:
+            self.load()
+
+    def names(self):
+        if self._names is None:
+            self._names = [l['nickname'] for l in self.layouts]
+        return self._names
+
+    def __len__(self):
+        return len(self.layouts)
+
+    def __getitem__(self, index):
+        return self.layouts[index]
+
+    def find(self, nickname):
+        index = self.index.get(nickname)
+        if index is None:
+            return None
+        return self.layouts[index]
+
+    def put(self, nickname, layout):
+        """ Save `layout` (a dict with 'cols', 'rows' and 'cells') as
+        `nickname`, replacing any layout already saved with that name. """
+        layout = dict(layout, nickname=nickname)
+        index = self.index.get(nickname)
+
+        if index is None:
+            self.index[nickname] = len(self.layouts)
+            self.layouts.append(layout)
+            self._names = None
+        else:
+            self.layouts[index] = layout
+        self.changed()
+
+    def remove(self, index):
+        self.layouts.pop(index)
+        self.reindex()
+        self.changed()
+
+    def changed(self):
+        if not self.save_scheduled:
+            self.save_scheduled = True
+            sublime.set_timeout_async(self.save, 0)
+
+    def save(self):
+        self.save_scheduled = False
+        self.written = [dict(l) for l in self.layouts]
+        self.store.set('saved_layouts', self.written)
+        sublime.save_settings(self.SETTINGS_FILE)
+
+
+class SavedSessions(object):
+    """ The sessions saved with origami_save_session, all in one settings
+    file. Writes happen from the async thread. """
+    SETTINGS_FILE = 'Origami Sessions.sublime-settings'
+
+    @classmethod
+    def store(cls):
+        return sublime.load_settings(cls.SETTINGS_FILE)
+
+    @classmethod
+    def names(cls):
+        return sorted(cls.store().get('sessions') or {})
+
+    @classmethod
+    def find(cls, name):
+        return (cls.store().get('sessions') or {}).get(name)
+
+    @classmethod
+    def put(cls, name, session):
+        def save():
+            store = cls.store()
+            sessions = dict(store.get('sessions') or {})
+            sessions[name] = session
+            store.set('sessions', sessions)
+            sublime.save_settings(cls.SETTINGS_FILE)
+
+        sublime.set_timeout_async(save, 0)
+
+
+class ResizePreview(object):
+    """ Live preview for the resize_pane input panel. Input that does not
+    parse yet is skipped, previews are applied at most once per `interval`
+    milliseconds and only when the layout actually changes. """
+
+    def __init__(self, window, orientation, layout, relevant_indx, interval):
+        self.window = window
+        self.orientation = orientation
+        self.original_layout = layout
+        self.relevant_indx = relevant_indx
+        self.interval = max(0, interval or 0) / 1000
+
+        self.shown_layout = layout
+        self.shown_time = 0
+        self.pending_text = None
+        self.scheduled = False
+        self.finished = False
+
+    def layout_for(self, text):
+        try:
+            input_data = [float(x) for x in text.split(',')]
+        except ValueError:
+            return None
+        return geometry.resize(self.original_layout, self.orientation, self.relevant_indx, input_data)
+
+    def update(self, text):
+        self.pending_text = text
+        if self.scheduled:
+            return
+
+        wait = self.shown_time + self.interval - time.time()
+        if wait > 0:
+            self.scheduled = True
+            set_timeout(self.flush, int(wait * 1000) + 1)
+        else:
+            self.flush()
+
+    def flush(self):
+        self.scheduled = False
+        text, self.pending_text = self.pending_text, None
+        if self.finished or text is None:
+            return
+
+        layout = self.layout_for(text)
+        if layout is None or layout == self.shown_layout:
+            return
+
+        self.shown_layout = layout
+        self.shown_time = time.time()
+        fixed_set_layout_no_focus_change(self.window, layout)
+
+    def done(self, text):
+        self.finished = True
+        layout = self.layout_for(text) or self.original_layout
+
+        # The history goes back to the layout from before the previews
+        if layout != self.original_layout:
+            LayoutHistory.record(self.window, self.original_layout, self.window.active_group(),
+                                 len(self.original_layout.cells))
+        # Lines dragged onto each other for good no longer split anything
+        with PauseLayoutHistory():
+            fixed_set_layout(self.window, geometry.compact(layout, merge=True))
+
 
 class PaneCommand(sublime_plugin.WindowCommand, WithSettings):
     """ Abstract base class for commands. """
 
+    def run_(self, *args):
+        with LayoutSnapshots(self.window):
+            if not profiler.enabled:
+                return super(PaneCommand, self).run_(*args)
+
+            with profiler.measure(type(self).__name__):
+                return super(PaneCommand, self).run_(*args)
+
+    def current_layout(self):
+        return current_layout(self.window)
+
+    def active_group(self):
+        return get_active_group(self.window)
+
     def layout(self):
-        layout = self.window.layout()
+        layout = self.current_layout().to_dict()
         cells = layout['cells']
         rows = layout['rows']
         cols = layout['cols']
@@ -163,42 +997,25 @@ class PaneCommand(sublime_plugin.WindowCommand, WithSettings):
     def get_cells(self):
         return self.layout()[2]
 
-    def adjacent_cell(self, direction):
-        cells = self.get_cells()
-        current_cell = cells[self.window.active_group()]
-        adjacent_cells = cells_adjacent_to_cell_in_direction(cells, current_cell, direction)
-        rows, cols, _ = self.layout()
-
-        if direction in ['left', 'right']:
-            MIN, MAX, fields = YMIN, YMAX, rows
-        else: #up or down
-            MIN, MAX, fields = XMIN, XMAX, cols
-
-        cell_overlap = []
-        for cell in adjacent_cells:
-            start = max(fields[cell[MIN]], fields[current_cell[MIN]])
-            end = min(fields[cell[MAX]], fields[current_cell[MAX]])
-            overlap = (end - start)# / (fields[cell[MAX]] - fields[cell[MIN]])
-            cell_overlap.append(overlap)
-
-        if len(cell_overlap) != 0:
-            cell_index = cell_overlap.index(max(cell_overlap))
-            return adjacent_cells[cell_index]
-        return None
+    def adjacent_group(self, direction):
+        layout = self.current_layout()
+        group = self.active_group()
+        preferred = TravelHistory.preferred(self.window, layout, group)
+        return adjacency_index(layout).adjacent_group(group, direction, preferred)
 
     def duplicated_views(self, original_group, duplicating_group):
-        original_views = self.window.views_in_group(original_group)
-        original_buffers = {v.buffer_id() for v in original_views}
-        potential_dupe_views = self.window.views_in_group(duplicating_group)
+        original_views = views_in_group(self.window, original_group)
+        original_buffers = {ViewIndex.buffer_id(v) for v in original_views}
+        potential_dupe_views = views_in_group(self.window, duplicating_group)
         dupe_views = []
         for view_to_remove in potential_dupe_views:
-            if view_to_remove.buffer_id() in original_buffers:
+            if ViewIndex.buffer_id(view_to_remove) in original_buffers:
                 dupe_views.append(view_to_remove)
         return dupe_views
 
     @classmethod
     def tabless_views(cls, window, duplicating_group):
-        potential_dupe_views = window.views_in_group(duplicating_group)
+        potential_dupe_views = views_in_group(window, duplicating_group)
         dupe_views = []
         for view_to_remove in potential_dupe_views:
             # print('tabless_views file_name', view_to_remove.file_name(), 'size', view_to_remove.size(), 'name', view_to_remove.name(), 'is_dirty', view_to_remove.is_dirty())
@@ -208,14 +1025,14 @@ class PaneCommand(sublime_plugin.WindowCommand, WithSettings):
 
     @staticmethod
     def is_tabless(view):
-        return view.size() < 1 and view.name() == '' and view.file_name() is None
+        # Most views have some text, which rules them out in one call
+        return view.size() < 1 and ViewIndex.file_name(view) is None and view.name() == ''
 
     def travel_to_pane(self, direction, create_new_if_necessary=False):
-        adjacent_cell = self.adjacent_cell(direction)
-        if adjacent_cell:
-            cells = self.get_cells()
-            new_group_index = cells.index(adjacent_cell)
-            self.window.focus_group(new_group_index)
+        new_group_index = self.adjacent_group(direction)
+        if new_group_index is not None:
+            TravelHistory.record(self.window, self.current_layout(), self.active_group(), new_group_index)
+            focus_group(self.window, new_group_index)
         elif create_new_if_necessary:
             self.create_pane(direction, True)
 
@@ -226,12 +1043,11 @@ class PaneCommand(sublime_plugin.WindowCommand, WithSettings):
             return
 
         window = self.window
+        group = self.active_group()
         self.travel_to_pane(direction, create_new_if_necessary)
 
-        active_group = window.active_group()
-        views_in_group = window.views_in_group(active_group)
-        window.set_view_index(view, active_group, len(views_in_group))
-        sublime.set_timeout(lambda: window.focus_view(view))
+        move_view(window, view, self.active_group(), from_group=group)
+        set_timeout(lambda: window.focus_view(view))
 
     def clone_file_to_pane(self, direction, create_new_if_necessary=False):
         window = self.window
@@ -239,28 +1055,46 @@ class PaneCommand(sublime_plugin.WindowCommand, WithSettings):
         if view == None:
             # If we're in an empty group, there's no active view
             return
-        group, original_index = window.get_view_index(view)
         window.run_command('clone_file')
-
-        # If we move the cloned file's tab to the left of the original's,
-        # then when we remove it from the group, focus will fall to the
-        # original view.
         new_view = window.active_view()
-        window.set_view_index(new_view, group, original_index)
+        # The clone opens in the group that has the focus on screen, which
+        # is not the pending one when a transaction already moved it
+        group = window.get_view_index(new_view)[0]
 
-        # Fix the new view's selection and viewport
+        # Give the clone the selection and folds of the original in one call
+        # each, however many regions there are
         new_sel = new_view.sel()
         new_sel.clear()
-        for s in view.sel():
-            new_sel.add(s)
-        sublime.set_timeout(lambda : new_view.set_viewport_position(view.viewport_position(), False), 0)
+        if hasattr(new_sel, 'add_all'):
+            new_sel.add_all(view.sel())
+        else:
+            for s in view.sel():
+                new_sel.add(s)
 
-        self.carry_file_to_pane(direction, create_new_if_necessary)
+        folded_regions = getattr(view, 'folded_regions', None)
+        if folded_regions:
+            folds = folded_regions()
+            if folds:
+                new_view.fold(folds)
+
+        viewport = view.viewport_position()
+        self.travel_to_pane(direction, create_new_if_necessary)
+        new_group = self.active_group()
+        if new_group != group:
+            move_view(window, new_view, new_group, from_group=group)
+
+        def show_clone():
+            # The original stays the visible tab of its pane, then the clone
+            # gets the focus, scrolled like the original
+            if new_group != group and window.active_view_in_group(group) != view:
+                window.focus_view(view)
+            window.focus_view(new_view)
+            new_view.set_viewport_position(viewport, False)
+
+        set_timeout(show_clone)
 
     def reorder_panes(self, leave_files_at_position = True):
-        _, _, cells = self.layout()
-        current_cell = cells[self.window.active_group()]
-        old_index = self.window.active_group()
+        old_index = self.active_group()
         on_done = partial(self._on_reorder_done, old_index, leave_files_at_position)
         view = self.window.show_input_panel('enter new index', str(old_index+1), on_done, None, None)
         view.sel().clear()
@@ -272,138 +1106,58 @@ class PaneCommand(sublime_plugin.WindowCommand, WithSettings):
         except ValueError:
             return
 
-        rows, cols, cells = self.layout()
+        order = list(range(len(self.current_layout().cells)))
 
-        if new_index < 0 or new_index >= len(cells):
+        if new_index < 0 or new_index >= len(order):
             return
 
-        cells[old_index], cells[new_index] = cells[new_index], cells[old_index]
+        order[old_index], order[new_index] = order[new_index], order[old_index]
+        self.permute_panes(order, leave_files_at_position)
 
-        if leave_files_at_position:
-            old_files = self.window.views_in_group(old_index)
-            new_files = self.window.views_in_group(new_index)
-            for position, v in enumerate(old_files):
-                self.window.set_view_index(v, new_index, position)
-            for position, v in enumerate(new_files):
-                self.window.set_view_index(v, old_index, position)
+    def permute_panes(self, order, leave_files_at_position=False):
+        """ Give group `index` the cell of group `order[index]`. The tabs of a
+        group go along with it, unless `leave_files_at_position` is set: then
+        the tabs stay where they are on screen and move to the group now
+        holding that place, which costs a tab move per view. """
+        window = self.window
 
-        layout = {'cols': cols, 'rows': rows, 'cells': cells}
-        fixed_set_layout(self.window, layout)
+        with layout_transaction(window):
+            layout = geometry.permute(self.current_layout(), order)
+            active_group = self.active_group()
 
-    def resize_panes(self, orientation, mode):
-        rows, cols, cells = self.layout()
-
-        if orientation == 'cols':
-            data = cols
-            min1 = YMIN
-            max1 = YMAX
-            min2 = XMIN
-            max2 = XMAX
-
-        elif orientation == 'rows':
-            data = rows
-            min1 = XMIN
-            max1 = XMAX
-            min2 = YMIN
-            max2 = YMAX
-
-        relevant_indx = set()
-
-        if mode == 'BEFORE':
-            current_cell = cells[self.window.active_group()]
-            relevant_indx.update(set([current_cell[min2]]))
-
-        elif mode == 'AFTER':
-            current_cell = cells[self.window.active_group()]
-            relevant_indx.update(set([current_cell[max2]]))
-
-        elif mode == 'NEAREST':
-            current_cell = cells[self.window.active_group()]
-            relevant_indx.update(set([current_cell[min2], current_cell[max2]]))
-
-        elif mode == 'RELEVANT':
-            current_cell = cells[self.window.active_group()]
-            min_val1 = current_cell[min1]
-            max_val1 = current_cell[max1]
-            for c in cells:
-                min_val2 = c[min1]
-                max_val2 = c[max1]
-                if min_val1 >= max_val2 or min_val2 >= max_val1:
-                    continue
-                relevant_indx.update(set([c[min2], c[max2]]))
+            if leave_files_at_position:
+                # Only the groups that change places have tabs to move
+                moved = [(group, old_group) for group, old_group in enumerate(order) if group != old_group]
+                views_by_group = dict((old_group, views_in_group(window, old_group)) for _, old_group in moved)
+                fixed_set_layout(window, layout)
 
-        elif mode == 'ALL':
-            relevant_indx.update(set(range(len(data))))
+                for group, old_group in moved:
+                    for position, view in enumerate(views_by_group[old_group]):
+                        move_view(window, view, group, position, old_group)
+                focus_group(window, order.index(active_group))
 
-        relevant_indx.difference_update(set([0, len(data)-1])) # dont show the first and last value (it's always 0 and 1)
-        relevant_indx = sorted(relevant_indx)
+            else:
+                fixed_set_layout(window, layout)
+
+    def resize_panes(self, orientation, mode):
+        layout = self.current_layout()
+        relevant_indx = geometry.relevant_lines(layout, self.active_group(), orientation, mode)
+        data = layout.cols if orientation == 'cols' else layout.rows
 
         text = ', '.join([str(data[i]) for i in relevant_indx])
-        on_done = partial(self._on_resize_panes, orientation, cells, relevant_indx, data)
-        on_update = partial(self._on_resize_panes_update, orientation, cells, relevant_indx, data)
-        on_cancle = partial(self._on_resize_panes, orientation, cells, relevant_indx, data, text)
-        view = self.window.show_input_panel(orientation, text, on_done, on_update, on_cancle)
+        interval = self.settings().get('resize_preview_interval', 50)
+        preview = ResizePreview(self.window, orientation, layout, relevant_indx, interval)
+        on_cancle = partial(preview.done, text)
+        view = self.window.show_input_panel(orientation, text, preview.done, preview.update, on_cancle)
         view.sel().clear()
         view.sel().add(sublime.Region(0,view.size()))
 
-    def _on_resize_panes_layout(self, orientation, cells, relevant_indx, orig_data, text):
-        window = self.window
-        rows, cols, _ = self.layout()
-
-        input_data = [float(x) for x in text.split(',')]
-        if any(d > 1.0 for d in input_data):
-            return {'cols': cols, 'rows': rows, 'cells': cells}
-
-        cells = copy.deepcopy(cells)
-        data = copy.deepcopy(orig_data)
-        for i, d in zip(relevant_indx, input_data):
-            data[i] = d
-
-        data = list(enumerate(data))
-        data = sorted(data, key=lambda x: x[1]) # sort such that you can swap grid lines
-        indxes, data = map(list, zip(*data)) # indexes are also sorted
-
-        revelant_cell_entries = []
-        if orientation == 'cols':
-            revelant_cell_entries = [XMIN,XMAX]
-        elif orientation == 'rows':
-            revelant_cell_entries = [YMIN,YMAX]
-
-        # change the cell boundaries according to the sorted indexes
-        transformations = [(old, new) for new, old in enumerate(indxes) if new != old]
-        for i in range(len(cells)):
-            for j in revelant_cell_entries:
-                for old, new in transformations:
-                    if cells[i][j] == old:
-                        cells[i][j] = new
-                        break
-
-        if orientation == 'cols':
-            if len(cols) == len(data):
-                cols = data
-        elif orientation == 'rows':
-            if len(rows) == len(data):
-                rows = data
-
-        return {'cols': cols, 'rows': rows, 'cells': cells}
-
-    def _on_resize_panes_update(self, orientation, cells, relevant_indx, orig_data, text):
-        layout = self._on_resize_panes_layout(orientation, cells, relevant_indx, orig_data, text)
-        fixed_set_layout_no_focus_change(self.window, layout)
-
-    def _on_resize_panes(self, orientation, cells, relevant_indx, orig_data, text):
-        layout = self._on_resize_panes_layout(orientation, cells, relevant_indx, orig_data, text)
-        fixed_set_layout(self.window, layout)
-
     def zoom_pane(self, fraction, skip_saving):
         window = self.window
-        active_group = window.active_group()
+        active_group = self.active_group()
+        state = ZoomStates.get(window)
 
-        settings = window.settings()
-        origami_fraction = settings.get( 'origami_fraction' )
-        original_panes_layout = settings.get( 'original_panes_layout' )
-
-        if not skip_saving and ( origami_fraction or original_panes_layout ):
+        if not skip_saving and ( state.fraction or state.is_zoomed() ):
             print('Origami Error: Trying to zoom a zoomed pane!')
             unmaximize_pane( window )
             return
@@ -412,113 +1166,73 @@ class PaneCommand(sublime_plugin.WindowCommand, WithSettings):
             fraction = .8
 
         fraction = min(1, max(0, fraction))
-        rows,cols,cells = self.layout()
-
-        current_cell = cells[active_group]
-        current_col = current_cell[0]
-        num_cols = len(cols)-1
+        layout = self.current_layout()
 
         if not skip_saving:
-            settings.set( 'original_panes_layout', window.layout() )
+            state.layout = layout
 
-        #TODO:  the sizes of the unzoomed panes are calculated incorrectly if the
-        #       unzoomed panes have a split that overlaps the zoomed pane.
-        current_col_width = 1 if num_cols==1 else fraction
-        other_col_width = 0 if num_cols==1 else (1-current_col_width)/(num_cols-1)
+        # Zooming in and out is not a step of the layout history by itself
+        with PauseLayoutHistory():
+            fixed_set_layout(window, geometry.zoom(layout, active_group, fraction))
 
-        cols = [0.0]
-        for i in range(0,num_cols):
-            cols.append(cols[i] + (current_col_width if i == current_col else other_col_width))
-
-        current_row = current_cell[1]
-        num_rows = len(rows)-1
-
-        current_row_height = 1 if num_rows==1 else fraction
-        other_row_height = 0 if num_rows==1 else (1-current_row_height)/(num_rows-1)
-        rows = [0.0]
-        for i in range(0,num_rows):
-            rows.append(rows[i] + (current_row_height if i == current_row else other_row_height))
-
-        layout = {'cols': cols, 'rows': rows, 'cells': cells}
-        fixed_set_layout(window, layout)
+        state.fraction = fraction
+        state.group = active_group
+        state.max_pane_maximized = None
 
+        settings = window.settings()
+        if not skip_saving:
+            settings.set( 'original_panes_layout', layout.to_dict() )
         settings.set( 'origami_fraction', fraction )
         settings.set( 'max_pane_maximized', None )
-        settings.set( 'maximized_pane_group', window.active_group() )
+        settings.set( 'maximized_pane_group', active_group )
 
     def unzoom_pane(self):
         window = self.window
-        active_group = window.active_group()
+        state = ZoomStates.get(window)
 
-        layout = self.settings().get('original_panes_layout')
+        layout = state.layout
         remember_panes_layout = self.settings().get('remember_panes_layout')
+        current_layout = self.current_layout()
 
-        window.settings().set( 'origami_fraction', None )
-        window.settings().set( 'original_panes_layout', None )
-        window.settings().set( 'max_pane_maximized', False )
-
-        if not ( remember_panes_layout and layout ):
-            rows,cols,cells = self.layout()
-            current_cell = cells[active_group]
-
-            num_cols = len(cols)-1
-            col_width = 1.0/num_cols
-
-            cols = [0.0]
-            for i in range(0,num_cols):
-                cols.append(cols[i] + col_width)
-
-            num_rows = len(rows)-1
-            row_height = 1.0/num_rows
+        # Only a layout with the same panes can be restored; panes may have
+        # been created or destroyed while zoomed
+        if not ( remember_panes_layout and layout and layout.cells == current_layout.cells
+                 and len(layout.cols) == len(current_layout.cols)
+                 and len(layout.rows) == len(current_layout.rows) ):
+            layout = geometry.unzoom(current_layout)
 
-            rows = [0.0]
-            for i in range(0,num_rows):
-                rows.append(rows[i] + row_height)
+        state.layout = None
+        state.fraction = None
+        state.group = None
+        state.max_pane_maximized = False
 
-            layout = {'cols': cols, 'rows': rows, 'cells': cells}
+        settings = window.settings()
+        settings.set( 'origami_fraction', None )
+        settings.set( 'original_panes_layout', None )
+        settings.set( 'max_pane_maximized', False )
 
-        fixed_set_layout(window, layout)
+        with PauseLayoutHistory():
+            fixed_set_layout(window, layout)
 
     def has_zoom(self):
         return is_pane_zoomed( self.window )
 
     def create_pane(self, direction, give_focus=False):
+        with layout_transaction(self.window):
+            self._create_pane_unzoomed(direction, give_focus)
+
+    def _create_pane_unzoomed(self, direction, give_focus):
         has_zoom = self.has_zoom()
-        fraction = self.window.settings().get( 'origami_fraction' )
+        fraction = ZoomStates.get(self.window).fraction
 
         give_focus = give_focus or has_zoom and not give_focus
         run_unzoomed( self, lambda: self._create_pane( direction, give_focus, has_zoom, fraction ) )
 
     def _create_pane(self, direction, give_focus, has_zoom, fraction):
         window = self.window
-        rows, cols, cells = self.layout()
-        active_group = window.active_group()
+        layout = geometry.create_pane(self.current_layout(), self.active_group(), direction)
 
-        old_cell = cells.pop(active_group)
-        new_cell = []
-
-        if direction in ('up', 'down'):
-            cells = push_down_cells_after(cells, old_cell[YMAX])
-            rows.insert(old_cell[YMAX], (rows[old_cell[YMIN]] + rows[old_cell[YMAX]]) / 2)
-            new_cell = [old_cell[XMIN], old_cell[YMAX], old_cell[XMAX], old_cell[YMAX]+1]
-            old_cell = [old_cell[XMIN], old_cell[YMIN], old_cell[XMAX], old_cell[YMAX]]
-
-        elif direction in ('right', 'left'):
-            cells = push_right_cells_after(cells, old_cell[XMAX])
-            cols.insert(old_cell[XMAX], (cols[old_cell[XMIN]] + cols[old_cell[XMAX]]) / 2)
-            new_cell = [old_cell[XMAX], old_cell[YMIN], old_cell[XMAX]+1, old_cell[YMAX]]
-            old_cell = [old_cell[XMIN], old_cell[YMIN], old_cell[XMAX], old_cell[YMAX]]
-
-        if new_cell:
-            if direction in ('left', 'up'):
-                focused_cell = new_cell
-                unfocused_cell = old_cell
-            else:
-                focused_cell = old_cell
-                unfocused_cell = new_cell
-            cells.insert(active_group, focused_cell)
-            cells.append(unfocused_cell)
-            layout = {'cols': cols, 'rows': rows, 'cells': cells}
+        if layout:
             fixed_set_layout(window, layout)
 
             if give_focus:
@@ -530,32 +1244,18 @@ class PaneCommand(sublime_plugin.WindowCommand, WithSettings):
     def _destroy_current_pane(self, has_zoom, fraction):
         #Out of the four adjacent panes, one was split to create this pane.
         #Find out which one, move to it, then destroy this pane.
-        cells = self.get_cells()
-
-        current = cells[self.window.active_group()]
-        choices = {}
-        choices['up'] = self.adjacent_cell('up')
-        choices['right'] = self.adjacent_cell('right')
-        choices['down'] = self.adjacent_cell('down')
-        choices['left'] = self.adjacent_cell('left')
-
-        target_dir = None
-        for dir,c in choices.items():
-            if not c:
-                continue
-            if dir in ['up', 'down']:
-                if c[XMIN] == current[XMIN] and c[XMAX] == current[XMAX]:
-                    target_dir = dir
-            elif dir in ['left', 'right']:
-                if c[YMIN] == current[YMIN] and c[YMAX] == current[YMAX]:
-                    target_dir = dir
+        target_dir = geometry.destroy_target_direction(self.current_layout(), self.active_group())
         if target_dir:
             self.travel_to_pane(target_dir)
             self._destroy_pane( opposite_direction( target_dir ), has_zoom, fraction )
 
     def destroy_pane(self, direction):
+        with layout_transaction(self.window):
+            self._destroy_pane_unzoomed(direction)
+
+    def _destroy_pane_unzoomed(self, direction):
         has_zoom = self.has_zoom()
-        fraction = self.window.settings().get( 'origami_fraction' )
+        fraction = ZoomStates.get(self.window).fraction
         run_unzoomed( self, lambda: self._destroy_pane( direction, has_zoom, fraction ) )
 
     def _destroy_pane(self, direction, has_zoom, fraction):
@@ -564,75 +1264,95 @@ class PaneCommand(sublime_plugin.WindowCommand, WithSettings):
             return
 
         window = self.window
-        rows, cols, cells = self.layout()
-        active_group = window.active_group()
-
-        cell_to_remove = None
-        current_cell = cells[active_group]
-
-        adjacent_cells = cells_adjacent_to_cell_in_direction(cells, current_cell, direction)
-        if len(adjacent_cells) == 1:
-            cell_to_remove = adjacent_cells[0]
+        result = geometry.destroy_pane(self.current_layout(), self.active_group(), direction)
 
-        if cell_to_remove:
-            active_view = window.active_view()
-            group_to_remove = cells.index(cell_to_remove)
-            # dupe_views = self.duplicated_views(active_group, group_to_remove)
+        if result:
+            layout, group_to_remove = result
+            # dupe_views = self.duplicated_views(self.active_group(), group_to_remove)
             dupe_views = self.tabless_views(window, group_to_remove)
 
             # print('destroy_pane dupe_views', dupe_views)
-            for view_to_remove in dupe_views:
-                window.focus_view(view_to_remove)
-                window.run_command('close')
-
-            if active_view:
-                window.focus_view(active_view)
-
-            cells.remove(cell_to_remove)
-            if direction == 'up':
-                rows.pop(cell_to_remove[YMAX])
-                adjacent_cells = cells_adjacent_to_cell_in_direction(cells, cell_to_remove, 'down')
-                for cell in adjacent_cells:
-                    cells[cells.index(cell)][YMIN] = cell_to_remove[YMIN]
-                cells = pull_up_cells_after(cells, cell_to_remove[YMAX])
-            elif direction == 'right':
-                cols.pop(cell_to_remove[XMIN])
-                adjacent_cells = cells_adjacent_to_cell_in_direction(cells, cell_to_remove, 'left')
-                for cell in adjacent_cells:
-                    cells[cells.index(cell)][XMAX] = cell_to_remove[XMAX]
-                cells = pull_left_cells_after(cells, cell_to_remove[XMIN])
-            elif direction == 'down':
-                rows.pop(cell_to_remove[YMIN])
-                adjacent_cells = cells_adjacent_to_cell_in_direction(cells, cell_to_remove, 'up')
-                for cell in adjacent_cells:
-                    cells[cells.index(cell)][YMAX] = cell_to_remove[YMAX]
-                cells = pull_up_cells_after(cells, cell_to_remove[YMIN])
-            elif direction == 'left':
-                cols.pop(cell_to_remove[XMAX])
-                adjacent_cells = cells_adjacent_to_cell_in_direction(cells, cell_to_remove, 'right')
-                for cell in adjacent_cells:
-                    cells[cells.index(cell)][XMIN] = cell_to_remove[XMIN]
-                cells = pull_left_cells_after(cells, cell_to_remove[XMAX])
-
-            layout = {'cols': cols, 'rows': rows, 'cells': cells}
+            if dupe_views:
+                close_views(window, dupe_views)
+
             fixed_set_layout(window, layout)
 
         if has_zoom and not self.settings().get('unzoom_after_closing_pane', False):
             maximize_pane( window, fraction )
 
     def pull_file_from_pane(self, direction):
-        adjacent_cell = self.adjacent_cell(direction)
-
-        if adjacent_cell:
-            cells = self.get_cells()
-            group_index = cells.index(adjacent_cell)
+        group_index = self.adjacent_group(direction)
 
+        if group_index is not None:
             view = self.window.active_view_in_group(group_index)
 
             if view:
-                active_group_index = self.window.active_group()
-                views_in_group = self.window.views_in_group(active_group_index)
-                self.window.set_view_index(view, active_group_index, len(views_in_group))
+                move_view(self.window, view, self.active_group(), from_group=group_index)
+
+    def step_layout_history(self, undo):
+        with layout_transaction(self.window):
+            run_unzoomed( self, lambda: self._step_layout_history( undo ) )
+
+    def _step_layout_history(self, undo):
+        window = self.window
+        undo_stack, redo_stack = LayoutHistory.stacks(window)
+        source, target = (undo_stack, redo_stack) if undo else (redo_stack, undo_stack)
+        if not source:
+            return
+
+        state = source.pop()
+        # Where those views are now is only known by asking
+        moved_views = [(view, None) for view, _ in state.assignments or ()]
+        previous = target[-1] if target else None
+        current = LayoutHistory.capture(window, self.current_layout(), self.active_group(),
+                                        len(state.layout.cells), moved_views, previous)
+        target.append(current)
+
+        LayoutTransaction.current(window).history = False
+        fixed_set_layout(window, state.layout)
+
+        # Only the views that are not in their old group anymore move
+        group_of = dict((view.id(), group) for view, group in current.assignments or ())
+        for view, group in state.assignments or ():
+            if view.id() in group_of and group_of[view.id()] != group:
+                move_view(window, view, group, from_group=group_of[view.id()])
+
+        focus_group(window, min(state.active_group, len(state.layout.cells) - 1))
+
+    def tile_panes(self, layout, distribute_views=False):
+        with layout_transaction(self.window):
+            run_unzoomed( self, lambda: self._tile_panes( layout, distribute_views ) )
+
+    def _tile_panes(self, layout, distribute_views):
+        window = self.window
+        views_by_group = None
+        if distribute_views:
+            views_by_group = self.views_by_group()
+
+        fixed_set_layout(window, layout)
+
+        if distribute_views:
+            self.move_views(plan_view_distribution(views_by_group, len(layout.cells)))
+
+    def views_by_group(self):
+        window = self.window
+        return [views_in_group(window, group) for group in range(len(self.current_layout().cells))]
+
+    def move_views(self, moves):
+        with layout_transaction(self.window):
+            for view, from_group, group, index in moves:
+                move_view(self.window, view, group, index, from_group)
+
+    def distribute_views(self, strategy):
+        window = self.window
+        active_view = window.active_view()
+        moves = plan_view_distribution(self.views_by_group(), len(self.current_layout().cells), strategy)
+        if not moves:
+            return
+
+        self.move_views(moves)
+        if active_view:
+            set_timeout(lambda: window.focus_view(active_view))
 
 
 class TravelToPaneCommand(PaneCommand):
@@ -658,14 +1378,16 @@ class CloneFileToPaneCommand(PaneCommand):
 
 class CreatePaneWithFileCommand(PaneCommand):
     def run(self, direction):
-        self.create_pane(direction)
-        self.carry_file_to_pane(direction)
+        with layout_transaction(self.window):
+            self.create_pane(direction)
+            self.carry_file_to_pane(direction)
 
 
 class CreatePaneWithClonedFileCommand(PaneCommand):
     def run(self, direction):
-        self.create_pane(direction)
-        self.clone_file_to_pane(direction)
+        with layout_transaction(self.window):
+            self.create_pane(direction)
+            self.clone_file_to_pane(direction)
 
 
 class PullFileFromPaneCommand(PaneCommand):
@@ -686,13 +1408,12 @@ class UnzoomPaneCommand(PaneCommand):
 class ToggleZoomPaneCommand(sublime_plugin.WindowCommand):
     def run(self, fraction=None):
         window = self.window
-        settings = window.settings()
-        max_pane_maximized = settings.get( 'max_pane_maximized' )
-        origami_fraction = settings.get( 'origami_fraction' )
-        original_panes_layout = settings.get( 'original_panes_layout' )
+        state = ZoomStates.get(window)
+        max_pane_maximized = state.max_pane_maximized
+        origami_fraction = state.fraction
 
-        # print( 'max_pane max_pane_maximized %-5s, origami_fraction: %-5s, original_panes_layout, %-5s' % ( max_pane_maximized, origami_fraction, original_panes_layout is not None ) )
-        if is_pane_zoomed( window ):
+        # print( 'max_pane max_pane_maximized %-5s, origami_fraction: %-5s, original_panes_layout, %-5s' % ( max_pane_maximized, origami_fraction, state.layout is not None ) )
+        if state.is_zoomed():
 
             if origami_fraction:
                 window.run_command( 'unzoom_pane' )
@@ -734,8 +1455,93 @@ class ResizePaneCommand(PaneCommand):
 
 
 class ReorderPaneCommand(PaneCommand):
+    def run(self, leave_files_at_position=True):
+        self.reorder_panes(leave_files_at_position)
+
+
+class PermutePanesCommand(PaneCommand):
+    """ Reorder all panes at once: 'rotate' (every pane takes the place of
+    the next one), 'rotate_back', 'reverse', or 'sort' (number the panes top
+    to bottom, left to right). """
+
+    def run(self, mode='rotate', leave_files_at_position=False):
+        layout = self.current_layout()
+        num_groups = len(layout.cells)
+
+        if mode == 'rotate':
+            order = [(group + 1) % num_groups for group in range(num_groups)]
+        elif mode == 'rotate_back':
+            order = [(group - 1) % num_groups for group in range(num_groups)]
+        elif mode == 'reverse':
+            order = list(reversed(range(num_groups)))
+        elif mode == 'sort':
+            order = geometry.reading_order(layout)
+        else:
+            print( "Origami Error: Unknown pane permutation '%s'!" % mode )
+            return
+
+        if order != list(range(num_groups)):
+            self.permute_panes(order, leave_files_at_position)
+
+
+class TilePanesCommand(PaneCommand):
+    """ Replace the layout with a `rows` x `cols` grid, or with `panes` panes
+    arranged by `strategy` ('columns', 'bsp' or 'golden'), in one layout
+    change. Asks for the number of panes (or "ROWSxCOLS") without arguments. """
+
+    def run(self, rows=None, cols=None, panes=None, strategy='columns', distribute_views=False):
+        if not (rows or cols or panes):
+            on_done = partial(self.on_done, strategy, distribute_views)
+            view = self.window.show_input_panel('Number of panes (or ROWSxCOLS):',
+                                                str(self.window.num_groups()), on_done, None, None)
+            view.sel().clear()
+            view.sel().add(sublime.Region(0, view.size()))
+            return
+
+        try:
+            if rows or cols:
+                layout = geometry.grid(max(1, rows or 1), max(1, cols or 1))
+            else:
+                layout = geometry.tile(panes, strategy)
+        except ValueError as error:
+            print( "Origami Error: %s" % error )
+            return
+
+        self.tile_panes(layout, distribute_views)
+
+    def on_done(self, strategy, distribute_views, text):
+        args = {'strategy': strategy, 'distribute_views': distribute_views}
+        try:
+            if 'x' in text.lower():
+                rows, cols = text.lower().split('x')
+                args.update(rows=int(rows), cols=int(cols))
+            else:
+                args.update(panes=int(text))
+        except ValueError:
+            return
+
+        self.window.run_command('tile_panes', args)
+
+
+class DistributeViewsCommand(PaneCommand):
+    """ Spread the open files over the existing panes by `strategy`:
+    'round_robin', 'least_loaded', 'directory' or 'extension'. """
+
+    def run(self, strategy='round_robin'):
+        try:
+            self.distribute_views(strategy)
+        except ValueError as error:
+            print( "Origami Error: %s" % error )
+
+
+class OrigamiUndoLayoutCommand(PaneCommand):
     def run(self):
-        self.reorder_panes()
+        self.step_layout_history(True)
+
+
+class OrigamiRedoLayoutCommand(PaneCommand):
+    def run(self):
+        self.step_layout_history(False)
 
 
 class SaveLayoutCommand(PaneCommand):
@@ -746,37 +1552,24 @@ class SaveLayoutCommand(PaneCommand):
         super(SaveLayoutCommand, self).__init__(window)
 
     def on_done(self, nickname):
-        saved_layouts = self.settings().get('saved_layouts')
-        layout_names = [l['nickname'] for l in saved_layouts]
-        layout_data = self.layout()
+        saved_layouts = SavedLayouts.get()
 
-        if nickname in layout_names:
+        if saved_layouts.find(nickname) is not None:
             dialog_str = ("You already have a layout stored as '{0}'.\n\n"
                           "Do you want to continue and overwrite that "
                           "layout?".format(nickname))
             dialog_btn = "Overwrite layout"
 
-            if sublime.ok_cancel_dialog(dialog_str, dialog_btn):
-                def get_index(seq, attr, value):
-                    return next(i for (i, d) in enumerate(seq) if d[attr] == value)
-
-                layout = saved_layouts[get_index(saved_layouts, 'nickname', nickname)]
-                layout['rows'] = layout_data[0]
-                layout['cols'] = layout_data[1]
-                layout['cells'] = layout_data[2]
-            else:
+            if not sublime.ok_cancel_dialog(dialog_str, dialog_btn):
                 self.window.run_command('save_layout')
                 return
-        else:
-            layout = {}
-            layout['nickname'] = nickname
-            layout['rows'] = layout_data[0]
-            layout['cols'] = layout_data[1]
-            layout['cells'] = layout_data[2]
-            saved_layouts.append(layout)
 
-        self.settings().set('saved_layouts', saved_layouts)
-        sublime.save_settings('Origami.sublime-settings')
+        layout_data = self.layout()
+        layout = {}
+        layout['rows'] = layout_data[0]
+        layout['cols'] = layout_data[1]
+        layout['cells'] = layout_data[2]
+        saved_layouts.put(nickname, layout)
 
     def run(self):
         self.window.show_input_panel(
@@ -796,21 +1589,16 @@ class RestoreLayoutCommand(PaneCommand):
         super(RestoreLayoutCommand, self).__init__(window)
 
     def on_done(self, index):
-        saved_layouts = self.settings().get('saved_layouts')
-
         if index != -1:
-            selected_layout = saved_layouts[index]
+            selected_layout = SavedLayouts.get()[index]
             layout = {}
             layout['cells'] = selected_layout['cells']
             layout['cols'] = selected_layout['cols']
             layout['rows'] = selected_layout['rows']
-            fixed_set_layout(self.window, layout)
+            restore_layout(self.window, layout)
 
     def run(self):
-        if self.settings().has('saved_layouts'):
-            saved_layouts = self.settings().get('saved_layouts')
-            layout_names = [l['nickname'] for l in saved_layouts]
-            self.window.show_quick_panel(layout_names, self.on_done)
+        self.window.show_quick_panel(SavedLayouts.get().names(), self.on_done)
 
 
 class RemoveLayoutCommand(PaneCommand):
@@ -821,18 +1609,11 @@ class RemoveLayoutCommand(PaneCommand):
         super(RemoveLayoutCommand, self).__init__(window)
 
     def on_done(self, index):
-        saved_layouts = self.settings().get('saved_layouts')
-
         if index != -1:
-            saved_layouts.pop(index)
-            self.settings().set('saved_layouts', saved_layouts)
-            sublime.save_settings('Origami.sublime-settings')
+            SavedLayouts.get().remove(index)
 
     def run(self):
-        if self.settings().has('saved_layouts'):
-            saved_layouts = self.settings().get('saved_layouts')
-            layout_names = [l['nickname'] for l in saved_layouts]
-            self.window.show_quick_panel(layout_names, self.on_done)
+        self.window.show_quick_panel(SavedLayouts.get().names(), self.on_done)
 
 
 class NewWindowFromSavedLayoutCommand(PaneCommand):
@@ -844,10 +1625,8 @@ class NewWindowFromSavedLayoutCommand(PaneCommand):
         super(NewWindowFromSavedLayoutCommand, self).__init__(window)
 
     def on_done(self, index):
-        saved_layouts = self.settings().get('saved_layouts')
-
         if index != -1:
-            selected_layout = saved_layouts[index]
+            selected_layout = SavedLayouts.get()[index]
             layout = {}
             layout['cells'] = selected_layout['cells']
             layout['cols'] = selected_layout['cols']
@@ -855,13 +1634,10 @@ class NewWindowFromSavedLayoutCommand(PaneCommand):
 
             self.window.run_command('new_window')
             new_window = sublime.active_window()
-            fixed_set_layout(new_window, layout)
+            restore_layout(new_window, layout)
 
     def run(self):
-        if self.settings().has('saved_layouts'):
-            saved_layouts = self.settings().get('saved_layouts')
-            layout_names = [l['nickname'] for l in saved_layouts]
-            self.window.show_quick_panel(layout_names, self.on_done)
+        self.window.show_quick_panel(SavedLayouts.get().names(), self.on_done)
 
 
 class NewWindowWithCurrentLayoutCommand(PaneCommand):
@@ -878,27 +1654,161 @@ class NewWindowWithCurrentLayoutCommand(PaneCommand):
         fixed_set_layout(new_window, layout)
 
 
+def capture_session(windows):
+    """ The layout, files, tab order and active views of `windows`, with
+    every file name stored once and referred to by its position in 'files'.
+    Views without a file cannot be reopened and are left out. """
+    files = []
+    file_index = {}
+    saved_windows = []
+
+    for window in windows:
+        # A zoomed window is saved as it will be once unzoomed, as nothing
+        # would unzoom the layout after a restore
+        layout = LayoutHistory.unzoomed_layout(window)
+        groups = []
+
+        for group in range(len(layout.cells)):
+            active_view = window.active_view_in_group(group)
+            active_index = 0
+            paths = []
+
+            for view in views_in_group(window, group):
+                file_name = view.file_name()
+                if file_name is None:
+                    continue
+                if file_name not in file_index:
+                    file_index[file_name] = len(files)
+                    files.append(file_name)
+                if view == active_view:
+                    active_index = len(paths)
+                paths.append(file_index[file_name])
+            groups.append([active_index, paths])
+
+        saved_windows.append({
+            'layout': layout.to_dict(),
+            'active_group': window.active_group(),
+            'groups': groups,
+        })
+
+    return {'files': files, 'windows': saved_windows}
+
+
+def restore_session_window(window, saved, files):
+    """ Give `window` the saved layout in one set_layout and open the active
+    file of every group right away. The other files of a group are opened
+    later, one group per `set_timeout` turn, and then put back in their tab
+    order. """
+    flags = getattr(sublime, 'FORCE_GROUP', 0)
+    active_group = saved.get('active_group', 0)
+    tasks = []
+
+    with SuppressListeners():
+        fixed_set_layout(window, saved['layout'])
+
+        for group, (active_index, paths) in enumerate(saved['groups']):
+            if not paths:
+                continue
+
+            view = window.open_file(files[paths[active_index]], flags, group)
+            if len(paths) > 1:
+                tasks.append(partial(open_session_group, window, group, view,
+                                     [files[path] for path in paths], active_index, active_group))
+
+        focus_group(window, active_group)
+
+    if tasks:
+        WindowWorkQueue.push(window, *tasks)
+
+
+def open_session_group(window, group, active_view, paths, active_index, active_group):
+    flags = getattr(sublime, 'FORCE_GROUP', 0)
+
+    with SuppressListeners():
+        for index, path in enumerate(paths):
+            if index != active_index:
+                window.open_file(path, flags, group)
+
+        window.set_view_index(active_view, group, active_index)
+        window.focus_view(active_view)
+        window.focus_group(active_group)
+
+
+class OrigamiSaveSessionCommand(sublime_plugin.WindowCommand):
+    """ Save the layout and open files of every window under a name. """
+
+    def on_done(self, name):
+        if not name:
+            return
+
+        if SavedSessions.find(name) is not None:
+            dialog_str = ("You already have a session stored as '{0}'.\n\n"
+                          "Do you want to continue and overwrite that "
+                          "session?".format(name))
+
+            if not sublime.ok_cancel_dialog(dialog_str, "Overwrite session"):
+                self.window.run_command('origami_save_session')
+                return
+
+        SavedSessions.put(name, capture_session(sublime.windows()))
+
+    def run(self):
+        self.window.show_input_panel('Session name:', '', self.on_done, None, None)
+
+
+class OrigamiRestoreSessionCommand(sublime_plugin.WindowCommand):
+    """ Bring back a saved session, one window for each window saved. The
+    first one reuses this window when it has no files open. """
+
+    def on_done(self, names, index):
+        if index == -1:
+            return
+
+        session = SavedSessions.find(names[index])
+        if not session:
+            return
+
+        window = self.window
+        reuse = not window.views() and window.num_groups() == 1
+
+        for saved in session['windows']:
+            if reuse:
+                reuse = False
+            else:
+                window.run_command('new_window')
+                window = sublime.active_window()
+            restore_session_window(window, saved, session['files'])
+
+    def run(self):
+        names = SavedSessions.names()
+        if not names:
+            sublime.status_message('Origami: No saved sessions')
+            return
+        self.window.show_quick_panel(names, partial(self.on_done, names))
+
+
 class AutoCloseEmptyPanes(sublime_plugin.EventListener, WithSettings):
     def is_tabless_view(self, view):
         """ When you make a new pane, it comes with a tabless view that gets a tab when you type
         into it. You also get a similar view when using the command palette to open a file.
         If we think it's this kind of view, return True."""
-        if sublime.version()[0] == '2':
-            return False
-        else:
-            window = view.window() or sublime.active_window()
-            if window and window.get_view_index(view)[1] == -1:
-                return True
+        window = view.window() or sublime.active_window()
+        if window and window.get_view_index(view)[1] == -1:
+            return True
         return False
 
-    def on_close(self, view):
-        if sublime.version()[0] == '2':
-            self.on_pre_close(view)
-
+    @profiled('AutoCloseEmptyPanes.on_pre_close')
     def on_pre_close(self, view):
-        # Read from global settings for backward compatibility
-        auto_close = view.settings().get('origami_auto_close_empty_panes', False)
-        auto_close = self.settings().get('auto_close_empty_panes', auto_close)
+        if SuppressListeners.depth:
+            return
+
+        auto_close = self.snapshot().auto_close_empty_panes
+        if auto_close is None:
+            # Read from the view settings for backward compatibility
+            auto_close = view.settings().get('origami_auto_close_empty_panes', False)
+
+        if not auto_close:
+            return
 
         if self.is_tabless_view(view):
             # We don't want to close the pane when closing a transient view
@@ -908,24 +1818,38 @@ class AutoCloseEmptyPanes(sublime_plugin.EventListener, WithSettings):
         active_group = window.active_group()
 
         # We're in pre_close, so use set_timeout to close the group right after this.
-        if len(window.views_in_group(active_group)) < 2:
+        if len(views_in_group(window, active_group)) < 2:
+            set_timeout( lambda: window.run_command('destroy_pane', {'direction':'self'}), 100 )
+
+
+class AutoZoomState(object):
+    """ Auto zoom bookkeeping of one window: the group zoomed last and the
+    activation waiting to be zoomed, if any. """
 
-            if auto_close:
-                sublime.set_timeout( lambda: window.run_command('destroy_pane', {'direction':'self'}), 100 )
+    def __init__(self):
+        self.active_group = -1
+        self.pending = None
+        self.scheduled = False
 
 
 class AutoZoomOnFocus(sublime_plugin.EventListener, WithSettings):
-    running = False
-    active_group = -1
+    windows = {}
 
-    def delayed_zoom(self, view, fraction):
+    def delayed_zoom(self, window_id):
         # zoom_pane hangs sublime if you destroy the pane above or to your left.
         # call it in a sublime.set_timeout to fix the issue
+        state = self.windows.get(window_id)
+        if state is None or state.pending is None:
+            return
+
+        view, fraction = state.pending
+        state.pending = None
+        state.scheduled = False
 
-        # Sublime Text 2 has issues on startup where views don't have windows yet.
-        # If we don't have a window yet, bail.
-        if view.window() is None:
-            self.running = False
+        # On startup, views may not have a window yet. If we don't have a
+        # window yet, bail.
+        window = view.window()
+        if window is None:
             return
 
         args = {}
@@ -933,15 +1857,20 @@ class AutoZoomOnFocus(sublime_plugin.EventListener, WithSettings):
         # than e.g. 'origami_auto_zoom_on_focus': .8.
         if fraction != True:
             args['fraction'] = fraction
-        view.window().run_command('zoom_pane', args)
-        self.running = False
 
+        # The zoom moves the focus around itself, don't zoom again for that
+        with SuppressListeners():
+            window.run_command('zoom_pane', args)
+
+    @profiled('AutoZoomOnFocus.on_activated')
     def on_activated(self, view):
-        if self.running:
+        if SuppressListeners.depth:
             return
-        # Read from global settings for backward compatibility
-        fraction = view.settings().get('origami_auto_zoom_on_focus', False)
-        fraction = self.settings().get('auto_zoom_on_focus', fraction)
+
+        fraction = self.snapshot().auto_zoom_on_focus
+        if fraction is None:
+            # Read from the view settings for backward compatibility
+            fraction = view.settings().get('origami_auto_zoom_on_focus', False)
 
         if not fraction:
             return
@@ -949,14 +1878,60 @@ class AutoZoomOnFocus(sublime_plugin.EventListener, WithSettings):
         if view.settings().get('is_widget'):
             return
 
-        new_active_group = view.window().active_group()
-        if new_active_group == self.active_group:
+        window = view.window()
+        if window is None:
+            return
+
+        window_id = window.id()
+        state = self.windows.get(window_id)
+        if state is None:
+            state = self.windows[window_id] = AutoZoomState()
+
+        new_active_group = window.active_group()
+        if new_active_group == state.active_group:
             return
 
-        self.active_group = new_active_group
-        self.running = True
+        # Only the latest activation of a burst gets zoomed
+        state.active_group = new_active_group
+        state.pending = (view, fraction)
+
+        if not state.scheduled:
+            state.scheduled = True
+            set_timeout(partial(self.delayed_zoom, window_id), self.snapshot().auto_zoom_on_focus_delay)
+
+    def on_pre_close_window(self, window):
+        self.windows.pop(window.id(), None)
+
+
+class WindowWorkQueue(object):
+    """ Runs queued callables on the main thread, in order, one per
+    `sublime.set_timeout` turn, so each one starts after the command run by
+    the previous one has finished. Every window has its own queue. """
+    queues = {}
 
-        sublime.set_timeout(lambda: self.delayed_zoom(view, fraction), 0)
+    @classmethod
+    def push(cls, window, *tasks):
+        window_id = window.id()
+        queue = cls.queues.get(window_id)
+
+        if queue is None:
+            queue = cls.queues[window_id] = deque()
+            set_timeout(partial(cls._run_next, window_id), 0)
+        queue.extend(tasks)
+
+    @classmethod
+    def _run_next(cls, window_id):
+        queue = cls.queues[window_id]
+        task = queue.popleft()
+
+        try:
+            task()
+
+        finally:
+            if queue:
+                set_timeout(partial(cls._run_next, window_id), 0)
+            else:
+                del cls.queues[window_id]
 
 
 class OrigamiMoveToGroupCommand(PaneCommand):
@@ -964,18 +1939,61 @@ class OrigamiMoveToGroupCommand(PaneCommand):
     def run(self, group):
         window = self.window
 
-        def move():
-            time.sleep(0.1)
+        WindowWorkQueue.push(
+            window,
+            lambda: window.run_command( 'move_to_group', { 'group': group } ),
+            lambda: window.run_command( 'focus_group', { 'group': group } ),
+        )
+
+
+class OrigamiShowStatsCommand(sublime_plugin.WindowCommand):
+    """ Show what the profiler recorded, optionally writing it as a Chrome
+    trace file too. Enable recording with "profiling": true. """
+
+    def run(self, write_trace=False, reset=False):
+        window = self.window
+        text = profiler.report()
+        text += '\nwindow.layout() calls: %d made, %d served from the command snapshot\n' % (
+                LayoutSnapshots.fetches, LayoutSnapshots.hits)
+        text += 'set_layout calls saved by layout transactions: %d\n' % LayoutTransaction.total_commits_saved
+
+        if 'plugin_loaded' in load_times:
+            text += 'Plugin load: %.3f ms importing origami.py, %.3f ms in plugin_loaded\n' % (
+                    load_times['import'], load_times['plugin_loaded'])
+
+        if write_trace:
+            import json
+            trace_path = os.path.join(sublime.packages_path(), 'User', 'Origami Trace.json')
+            with open(trace_path, 'w') as trace_file:
+                json.dump(profiler.chrome_trace(), trace_file)
+            text += 'Chrome trace written to %s\n' % trace_path
+
+        if reset:
+            profiler.reset()
+
+        panel = window.create_output_panel('origami_stats')
+        panel.run_command('append', {'characters': text})
+        window.run_command('show_panel', {'panel': 'output.origami_stats'})
+
+
+# Milliseconds spent importing this module and in plugin_loaded
+load_times = {}
+
+
+def plugin_loaded():
+    started = time.perf_counter()
+    SettingsSnapshot.get()
+    load_times['plugin_loaded'] = (time.perf_counter() - started) * 1000
 
-            # print('running move')
-            window.run_command( 'move_to_group', { 'group': group } )
-            threading.Thread(target=focus).start()
+    if SettingsSnapshot.get().profiling:
+        print('Origami: loaded in %.3f ms (import %.3f ms, plugin_loaded %.3f ms)' % (
+              load_times['import'] + load_times['plugin_loaded'],
+              load_times['import'], load_times['plugin_loaded']))
 
-        def focus():
-            time.sleep(0.2)
 
-            # print('running focus')
-            window.run_command( 'focus_group', { 'group': group } )
+def plugin_unloaded():
+    SettingsSnapshot.release()
+    SavedLayouts.release()
 
-        threading.Thread(target=move).start()
 
+load_times['import'] = (time.perf_counter() - _import_started) * 1000
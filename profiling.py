@@ -0,0 +1,169 @@
+""" Opt-in profiling for Origami commands and event listeners.
+
+Nothing is recorded unless `profiler.enabled` is set (the "profiling"
+package setting). While enabled, every measured invocation records its
+wall time into a per-name histogram, together with the editor calls Origami
+counted while it ran, and is kept as a Chrome trace event so the session can
+be inspected in chrome://tracing or Perfetto.
+"""
+from __future__ import division
+
+import functools
+import time
+from collections import deque
+
+
+class Histogram(object):
+    """ Wall times in milliseconds, counted in power-of-two buckets. """
+    BOUNDS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        index = 0
+        while index < len(self.BOUNDS) and value > self.BOUNDS[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def rows(self):
+        """ (label, count) for every non-empty bucket. """
+        rows = []
+        for index, count in enumerate(self.buckets):
+            if not count:
+                continue
+            if index < len(self.BOUNDS):
+                rows.append(('<= %g ms' % self.BOUNDS[index], count))
+            else:
+                rows.append(('> %g ms' % self.BOUNDS[-1], count))
+        return rows
+
+
+class Sample(object):
+
+    def __init__(self, name, start):
+        self.name = name
+        self.start = start
+        self.counters = {}
+
+
+class Profiler(object):
+    """ Collects timings and call counters per command or listener name. """
+    MAX_TRACE_EVENTS = 20000
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}
+        self.counters = {}
+        self.trace = deque(maxlen=self.MAX_TRACE_EVENTS)
+        self.stack = []
+        self.origin = time.perf_counter()
+
+    def count(self, counter, amount=1):
+        """ Add `amount` to `counter` of the invocation being measured. """
+        if self.stack:
+            counters = self.stack[-1].counters
+            counters[counter] = counters.get(counter, 0) + amount
+
+    def measure(self, name):
+        return _Measurement(self, name)
+
+    def _begin(self, name):
+        self.stack.append(Sample(name, time.perf_counter()))
+
+    def _end(self):
+        sample = self.stack.pop()
+        end = time.perf_counter()
+        elapsed = (end - sample.start) * 1000
+
+        histogram = self.histograms.get(sample.name)
+        if histogram is None:
+            histogram = self.histograms[sample.name] = Histogram()
+        histogram.add(elapsed)
+
+        totals = self.counters.setdefault(sample.name, {})
+        for counter, amount in sample.counters.items():
+            totals[counter] = totals.get(counter, 0) + amount
+            # nested invocations also count towards the one that started them
+            if self.stack:
+                parent = self.stack[-1].counters
+                parent[counter] = parent.get(counter, 0) + amount
+
+        self.trace.append({
+            'name': sample.name,
+            'ph': 'X',
+            'ts': int((sample.start - self.origin) * 1000000),
+            'dur': int((end - sample.start) * 1000000),
+            'pid': 1,
+            'tid': 1,
+            'args': dict(sample.counters),
+        })
+
+    def report(self):
+        """ A plain text summary of everything recorded so far. """
+        if not self.histograms:
+            return 'No samples recorded. Set "profiling": true in Origami.sublime-settings.\n'
+
+        lines = []
+        for name in sorted(self.histograms, key=lambda n: -self.histograms[n].total):
+            histogram = self.histograms[name]
+            lines.append('%s: %d calls, mean %.3f ms, max %.3f ms, total %.3f ms' % (
+                name, histogram.count, histogram.mean(), histogram.max, histogram.total))
+
+            counters = self.counters.get(name)
+            if counters:
+                lines.append('    ' + ', '.join('%s %.1f/call' % (counter, counters[counter] / histogram.count)
+                                                for counter in sorted(counters)))
+            for label, count in histogram.rows():
+                lines.append('    %-12s %d' % (label, count))
+            lines.append('')
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        """ The recorded invocations in the Chrome trace event format. """
+        return {'traceEvents': list(self.trace), 'displayTimeUnit': 'ms'}
+
+
+class _Measurement(object):
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._begin(self.name)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler._end()
+
+
+profiler = Profiler()
+
+
+def profiled(name):
+    """ Decorator measuring every call of the function as `name` while the
+    profiler is enabled. """
+    def decorate(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+
+            with profiler.measure(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+    return decorate
@@ -0,0 +1,305 @@
+""" Tests for geometry.py, which needs no editor: run them with
+`python -m unittest discover tests` from the package directory. """
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import geometry
+from geometry import Layout
+
+
+def columns(*cols):
+    """ A single row of panes split at `cols`. """
+    return Layout.make(cols, [0.0, 1.0], [[i, 0, i+1, 1] for i in range(len(cols)-1)])
+
+
+SINGLE = columns(0.0, 1.0)
+
+# +---+---+
+# | 0 | 1 |
+# +---+---+
+# |   2   |
+# +-------+
+T_LAYOUT = Layout.make([0.0, 0.5, 1.0], [0.0, 0.5, 1.0],
+                       [[0, 0, 1, 1], [1, 0, 2, 1], [0, 1, 2, 2]])
+
+
+# +---+-------+
+# | 0 |   1   |
+# +---+---+---+
+# |   2   | 3 |
+# +-------+---+
+STAGGERED = Layout.make([0.0, 1/3, 2/3, 1.0], [0.0, 0.5, 1.0],
+                        [[0, 0, 1, 1], [1, 0, 3, 1], [0, 1, 2, 2], [2, 1, 3, 2]])
+
+
+class CompactTest(unittest.TestCase):
+    def test_minimal_layout_is_returned_as_is(self):
+        layout = geometry.grid(2, 2)
+        self.assertIs(geometry.compact(layout), layout)
+        self.assertIs(geometry.compact(STAGGERED, merge=True), STAGGERED)
+
+    def test_unused_line_is_dropped(self):
+        layout = Layout.make([0.0, 0.3, 0.5, 1.0], [0.0, 1.0], [[0, 0, 2, 1], [2, 0, 3, 1]])
+        self.assertEqual(geometry.compact(layout), columns(0.0, 0.5, 1.0))
+
+    def test_rows_and_cells_are_renumbered(self):
+        layout = Layout.make([0.0, 1.0], [0.0, 0.2, 0.6, 1.0], [[0, 0, 1, 2], [0, 2, 1, 3]])
+        self.assertEqual(geometry.compact(layout),
+                         Layout.make([0.0, 1.0], [0.0, 0.6, 1.0], [[0, 0, 1, 1], [0, 1, 1, 2]]))
+
+    def test_lines_at_the_same_position_are_merged_on_request(self):
+        layout = Layout.make([0.0, 0.5, 0.5, 1.0], [0.0, 1.0], [[0, 0, 1, 1], [2, 0, 3, 1]])
+        self.assertIs(geometry.compact(layout), layout)
+        self.assertEqual(geometry.compact(layout, merge=True), columns(0.0, 0.5, 1.0))
+
+    def test_zoomed_layout_keeps_its_cells(self):
+        # Zooming all the way stacks the inner lines; unzooming must find
+        # the same cells to put the old proportions back
+        for group in range(len(STAGGERED.cells)):
+            zoomed = geometry.compact(geometry.zoom(STAGGERED, group, 1.0))
+            self.assertEqual(zoomed.cells, STAGGERED.cells)
+            self.assertEqual(len(zoomed.cols), len(STAGGERED.cols))
+            self.assertEqual(geometry.compact(geometry.unzoom(zoomed)).cells, STAGGERED.cells)
+
+
+class CreatePaneTest(unittest.TestCase):
+    def test_split_right_appends_the_new_pane(self):
+        self.assertEqual(geometry.create_pane(SINGLE, 0, 'right'), columns(0.0, 0.5, 1.0))
+
+    def test_split_down_appends_the_new_pane(self):
+        self.assertEqual(geometry.create_pane(SINGLE, 0, 'down'),
+                         Layout.make([0.0, 1.0], [0.0, 0.5, 1.0], [[0, 0, 1, 1], [0, 1, 1, 2]]))
+
+    def test_split_left_moves_the_group_to_the_far_half(self):
+        # The views stay in group 0, which now sits on the right
+        self.assertEqual(geometry.create_pane(SINGLE, 0, 'left'),
+                         Layout.make([0.0, 0.5, 1.0], [0.0, 1.0], [[1, 0, 2, 1], [0, 0, 1, 1]]))
+
+    def test_split_only_the_pane(self):
+        layout = geometry.create_pane(T_LAYOUT, 0, 'down')
+        self.assertEqual(layout.rows, (0.0, 0.25, 0.5, 1.0))
+        self.assertEqual(layout.cells, ((0, 0, 1, 1), (1, 0, 2, 2), (0, 2, 2, 3), (0, 1, 1, 2)))
+
+    def test_unknown_direction(self):
+        self.assertIsNone(geometry.create_pane(SINGLE, 0, 'sideways'))
+
+
+class DestroyPaneTest(unittest.TestCase):
+    def test_create_then_destroy_round_trip(self):
+        for layout in (SINGLE, T_LAYOUT, geometry.grid(2, 2)):
+            for group in range(len(layout.cells)):
+                for direction in ('up', 'right', 'down', 'left'):
+                    created = geometry.create_pane(layout, group, direction)
+                    # whichever way it went, the pane in `direction` is the appended one
+                    back = geometry.destroy_pane(created, group, direction)
+                    self.assertEqual(back, (layout, len(layout.cells)), (group, direction))
+
+    def test_target_direction_is_the_pane_split_from(self):
+        created = geometry.create_pane(T_LAYOUT, 2, 'right')
+        self.assertEqual(geometry.destroy_target_direction(created, 3), 'left')
+        self.assertEqual(geometry.destroy_target_direction(created, 2), 'right')
+
+    def test_only_a_single_pane_on_the_line_goes(self):
+        # Panes 0 and 1 share the line below them with nothing else
+        self.assertIsNone(geometry.destroy_pane(T_LAYOUT, 2, 'up'))
+        layout, removed = geometry.destroy_pane(T_LAYOUT, 0, 'down')
+        self.assertEqual(removed, 2)
+        self.assertEqual(layout, Layout.make([0.0, 0.5, 1.0], [0.0, 1.0], [[0, 0, 1, 1], [1, 0, 2, 1]]))
+
+    def test_nothing_on_that_side(self):
+        self.assertIsNone(geometry.destroy_pane(T_LAYOUT, 0, 'left'))
+
+
+class ZoomTest(unittest.TestCase):
+    def test_zoom_gives_the_group_its_fraction(self):
+        layout = geometry.zoom(geometry.grid(2, 2), 3, 0.8)
+        self.assertEqual([round(x, 9) for x in layout.cols], [0.0, 0.2, 1.0])
+        self.assertEqual([round(x, 9) for x in layout.rows], [0.0, 0.2, 1.0])
+        self.assertEqual(layout.cells, geometry.grid(2, 2).cells)
+
+    def test_fraction_is_clamped(self):
+        layout = geometry.zoom(columns(0.0, 0.5, 1.0), 0, 3)
+        self.assertEqual(layout.cols, (0.0, 1.0, 1.0))
+
+    def test_single_line_takes_everything(self):
+        self.assertEqual(geometry.zoom(SINGLE, 0, 0.5), SINGLE)
+
+    def test_zoom_then_unzoom_round_trip(self):
+        for layout in (SINGLE, T_LAYOUT, geometry.grid(2, 2), geometry.grid(3, 3)):
+            for group in range(len(layout.cells)):
+                unzoomed = geometry.unzoom(geometry.zoom(layout, group, 0.9))
+                self.assertEqual(unzoomed.cells, layout.cells)
+                for got, expected in zip(unzoomed.cols + unzoomed.rows, layout.cols + layout.rows):
+                    self.assertAlmostEqual(got, expected)
+
+
+class ResizeTest(unittest.TestCase):
+    def test_relevant_lines(self):
+        layout = geometry.grid(2, 3)
+        self.assertEqual(geometry.relevant_lines(layout, 4, 'cols', 'BEFORE'), [1])
+        self.assertEqual(geometry.relevant_lines(layout, 4, 'cols', 'AFTER'), [2])
+        self.assertEqual(geometry.relevant_lines(layout, 4, 'cols', 'NEAREST'), [1, 2])
+        self.assertEqual(geometry.relevant_lines(layout, 0, 'cols', 'NEAREST'), [1])
+        self.assertEqual(geometry.relevant_lines(layout, 0, 'rows', 'ALL'), [1])
+        self.assertEqual(geometry.relevant_lines(T_LAYOUT, 0, 'cols', 'RELEVANT'), [1])
+        self.assertEqual(geometry.relevant_lines(T_LAYOUT, 2, 'cols', 'RELEVANT'), [])
+
+    def test_resize_moves_the_lines(self):
+        layout = geometry.resize(geometry.grid(1, 3), 'cols', [1, 2], [0.25, 0.75])
+        self.assertEqual(layout, columns(0.0, 0.25, 0.75, 1.0))
+
+    def test_crossing_lines_keep_the_neighbours(self):
+        layout = geometry.resize(columns(0.0, 0.25, 0.75, 1.0), 'cols', [1], [0.9])
+        self.assertEqual(layout.cols, (0.0, 0.75, 0.9, 1.0))
+        self.assertEqual(layout.cells, ((0, 0, 2, 1), (2, 0, 1, 1), (1, 0, 3, 1)))
+
+    def test_resize_back_round_trip(self):
+        layout = geometry.create_pane(T_LAYOUT, 1, 'down')
+        resized = geometry.resize(layout, 'rows', [1, 2], [0.3, 0.6])
+        self.assertEqual(geometry.resize(resized, 'rows', [1, 2], list(layout.rows[1:3])), layout)
+
+    def test_values_out_of_range_change_nothing(self):
+        self.assertIs(geometry.resize(T_LAYOUT, 'cols', [1], [1.5]), T_LAYOUT)
+
+
+class PermuteTest(unittest.TestCase):
+    def test_permute_then_inverse_round_trip(self):
+        layout = geometry.grid(2, 2)
+        order = [2, 0, 3, 1]
+        inverse = [order.index(group) for group in range(len(order))]
+        permuted = geometry.permute(layout, order)
+        self.assertEqual(permuted.cells[0], layout.cells[2])
+        self.assertEqual(geometry.permute(permuted, inverse), layout)
+
+    def test_reading_order(self):
+        layout = geometry.permute(geometry.grid(2, 2), [3, 2, 1, 0])
+        self.assertEqual(geometry.reading_order(layout), [3, 2, 1, 0])
+
+
+
+class MatchLayoutTest(unittest.TestCase):
+    def test_same_layout_keeps_every_group(self):
+        layout, targets = geometry.match_layout(T_LAYOUT, T_LAYOUT)
+        self.assertEqual(layout, T_LAYOUT)
+        self.assertEqual(targets, [0, 1, 2])
+
+    def test_groups_keep_the_cell_overlapping_them_most(self):
+        # The same two columns, listed right to left
+        swapped = Layout.make([0.0, 0.5, 1.0], [0.0, 1.0], [[1, 0, 2, 1], [0, 0, 1, 1]])
+        layout, targets = geometry.match_layout(columns(0.0, 0.5, 1.0), swapped)
+        self.assertEqual(layout, columns(0.0, 0.5, 1.0))
+        self.assertEqual(targets, [0, 1])
+
+    def test_extra_old_groups_join_the_cell_covering_most_of_them(self):
+        layout, targets = geometry.match_layout(columns(0.0, 0.4, 0.6, 1.0), columns(0.0, 0.5, 1.0))
+        self.assertEqual(layout, columns(0.0, 0.5, 1.0))
+        self.assertEqual(targets, [0, 0, 1])
+
+    def test_new_cells_without_a_match_fill_the_remaining_indexes(self):
+        layout, targets = geometry.match_layout(SINGLE, columns(0.0, 0.5, 1.0))
+        self.assertEqual(targets, [0])
+        self.assertEqual(len(layout.cells), 2)
+        self.assertEqual(layout.cells[0], (0, 0, 1, 1))
+
+
+
+class TileTest(unittest.TestCase):
+    def assertTiles(self, layout, panes):
+        self.assertEqual(len(layout.cells), panes)
+        rectangles = [geometry.cell_rectangle(layout, group) for group in range(panes)]
+        self.assertAlmostEqual(sum(geometry.overlap_area(r, (0.0, 0.0, 1.0, 1.0)) for r in rectangles), 1.0)
+        for first in range(panes):
+            for second in range(first + 1, panes):
+                self.assertEqual(geometry.overlap_area(rectangles[first], rectangles[second]), 0)
+
+    def test_every_strategy_covers_the_window_once(self):
+        for strategy in sorted(geometry.TILING_STRATEGIES):
+            for panes in range(1, 10):
+                self.assertTiles(geometry.tile(panes, strategy), panes)
+
+    def test_at_least_one_pane(self):
+        self.assertEqual(geometry.tile(0), SINGLE)
+
+    def test_unknown_strategy(self):
+        self.assertRaises(ValueError, geometry.tile, 3, 'spiral')
+
+    def test_grid(self):
+        layout = geometry.grid(2, 3)
+        self.assertEqual(layout.cols, (0.0, 0.333333333, 0.666666667, 1.0))
+        self.assertEqual(layout.rows, (0.0, 0.5, 1.0))
+        self.assertEqual(layout.cells[4], (1, 1, 2, 2))
+
+
+
+class AdjacencyTest(unittest.TestCase):
+    def test_neighbours_share_part_of_the_edge(self):
+        index = geometry.AdjacencyIndex(T_LAYOUT)
+        self.assertEqual(index.neighbours['down'][0], [(2, 0.5)])
+        self.assertEqual(index.neighbours['up'][2], [(0, 0.5), (1, 0.5)])
+        self.assertEqual(index.adjacent_groups(0, 'right'), [1])
+        self.assertEqual(index.adjacent_groups(0, 'left'), [])
+        self.assertEqual(index.adjacent_groups(2, 'down'), [])
+
+    def test_corners_are_not_neighbours(self):
+        index = geometry.AdjacencyIndex(geometry.grid(2, 2))
+        self.assertEqual(index.adjacent_groups(0, 'right'), [1])
+        self.assertEqual(index.adjacent_groups(0, 'down'), [2])
+        self.assertEqual(index.adjacent_groups(3, 'up'), [1])
+
+    def test_line_neighbours_include_groups_without_overlap(self):
+        # +---+---+
+        # | 0 |   |
+        # +---+ 2 |
+        # | 1 |   |
+        # +---+---+
+        # |   3   |
+        # +-------+
+        layout = Layout.make([0.0, 0.5, 1.0], [0.0, 0.25, 0.5, 1.0],
+                             [[0, 0, 1, 1], [0, 1, 1, 2], [1, 0, 2, 2], [0, 2, 2, 3]])
+        index = geometry.AdjacencyIndex(layout)
+        self.assertEqual(index.adjacent_groups(0, 'down'), [1])
+        self.assertEqual(index.adjacent_groups(1, 'right'), [2])
+        self.assertEqual(sorted(index.line_neighbours['up'][3]), [1, 2])
+        self.assertEqual(index.adjacent_groups(3, 'up'), [1, 2])
+
+    def test_longest_shared_edge_wins(self):
+        layout = Layout.make([0.0, 0.3, 1.0], [0.0, 0.5, 1.0],
+                             [[0, 0, 1, 1], [1, 0, 2, 1], [0, 1, 2, 2]])
+        self.assertEqual(geometry.AdjacencyIndex(layout).adjacent_group(2, 'up'), 1)
+
+    def test_first_along_the_edge_wins_a_tie(self):
+        self.assertEqual(geometry.AdjacencyIndex(T_LAYOUT).adjacent_group(2, 'up'), 0)
+
+    def test_preferred_neighbour_wins(self):
+        index = geometry.AdjacencyIndex(T_LAYOUT)
+        self.assertEqual(index.adjacent_group(2, 'up', preferred=1), 1)
+        # a preferred group that is not a neighbour changes nothing
+        self.assertEqual(index.adjacent_group(0, 'down', preferred=1), 2)
+
+    def test_no_neighbour(self):
+        self.assertIsNone(geometry.AdjacencyIndex(T_LAYOUT).adjacent_group(0, 'up'))
+
+    def test_sweep_matches_a_pairwise_scan(self):
+        for layout in (T_LAYOUT, STAGGERED, geometry.tile(7, 'bsp'), geometry.tile(9, 'golden')):
+            index = geometry.AdjacencyIndex(layout)
+            for group, cell in enumerate(layout.cells):
+                for direction in ('up', 'right', 'down', 'left'):
+                    on_line = geometry.cells_adjacent_to_cell_in_direction(
+                        [list(c) for c in layout.cells], list(cell), direction)
+                    # of the cells across the line, the ones sharing some of it
+                    lo, hi = (0, 2) if direction in ('up', 'down') else (1, 3)
+                    expected = sorted(c for c in on_line if min(c[hi], cell[hi]) > max(c[lo], cell[lo]))
+                    got = sorted(list(layout.cells[other]) for other in index.adjacent_groups(group, direction))
+                    self.assertEqual(got, expected, (group, direction))
+                    self.assertEqual(sorted(index.line_neighbours[direction][group]),
+                                     sorted(layout.cells.index(tuple(c)) for c in on_line))
+
+    def test_index_is_cached_per_layout(self):
+        self.assertIs(geometry.adjacency_index(T_LAYOUT), geometry.adjacency_index(T_LAYOUT))
+
+
+if __name__ == '__main__':
+    unittest.main()